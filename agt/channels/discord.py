@@ -61,11 +61,9 @@ async def on_message(message: Message):
 
     sc = sess_mgr.get_session(session_id, entry, output_callback)
 
-    sc.conv_state.memory["user_id"] = "#".join(
-        (message.author.name, message.author.discriminator)
-    )
+    user_id = "#".join((message.author.name, message.author.discriminator))
 
-    await sc.conv_state.put_user_input(message.content)
+    await sc.user_turn(message.content, {"user_id": user_id})
 
 
 client.run(DISCORD_KEY)
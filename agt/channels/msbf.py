@@ -51,9 +51,7 @@ class PuppetBot(ActivityHandler):
 
         sc = sess_mgr.get_session(session_id, entry, output_callback)
 
-        sc.conv_state.memory["user_id"] = session_id
-
-        await sc.conv_state.put_user_input(turn_context.activity.text)
+        await sc.user_turn(turn_context.activity.text, {"user_id": session_id})
 
 
 # Create the Bot
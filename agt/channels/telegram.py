@@ -44,9 +44,7 @@ async def on_message(message: types.Message):
 
     sc = sess_mgr.get_session(session_id, entry, output_callback)
 
-    sc.conv_state.memory["user_id"] = message.chat.id
-
-    await sc.conv_state.put_user_input(message.text)
+    await sc.user_turn(message.text, {"user_id": message.chat.id})
 
 
 if __name__ == "__main__":
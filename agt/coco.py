@@ -1,7 +1,9 @@
+import time
+
 from typing import Callable, Dict
 from agt import ConversationState
 from agt.state import Outputs
-from coco.async_api import ComponentSession
+from agt.http_pool import get_http_pool
 from coco.coco import CoCoResponse
 
 
@@ -18,22 +20,41 @@ async def emit_responses(state: ConversationState, component_response: CoCoRespo
         await state.say(component_response.response)
 
 
+async def exchange(state, component_id, user_input, context, parameters) -> CoCoResponse:
+    """
+    remote component exchange, timed for the state hooks
+    """
+    start_time = time.perf_counter()
+    failed = True
+    try:
+        component_response = await get_http_pool().exchange(
+            component_id,
+            state.session_id,
+            user_input,
+            context=context,
+            parameters=parameters,
+            flatten_context=True,
+            source_language_code=state.memory.get("source_language_code"),
+        )
+        failed = component_response.component_failed
+        return component_response
+    finally:
+        if state.hooks is not None:
+            state.hooks.remote_call(
+                state, component_id, time.perf_counter() - start_time, failed
+            )
+
+
 async def coco(
     state, component_id, user_input=None, context={}, params={}, **extra_params
 ):
-    component_session = ComponentSession(component_id, state.session_id)
-
     if not user_input:
         user_input = await state.user_input()
 
-    component_response = await component_session(
-        user_input,
-        context=context,
-        parameters={**extra_params, **params},
-        flatten_context=True,
-        source_language_code=state.memory.get("source_language_code"),
+    component_response = await exchange(
+        state, component_id, user_input, context, {**extra_params, **params}
     )
-    state.memory = {**state.memory, **component_response.updated_context}
+    state.memory.update(component_response.updated_context)
 
     while not component_response.component_done:
         await emit_responses(state, component_response)
@@ -41,14 +62,10 @@ async def coco(
         if component_response.out_of_context:
             await state.out_of_context(state.last_user_input())
         user_input = await state.user_input()
-        component_response = await component_session(
-            user_input,
-            context=context,
-            parameters={**extra_params, **params},
-            flatten_context=True,
-            source_language_code=state.memory.get("source_language_code"),
+        component_response = await exchange(
+            state, component_id, user_input, context, {**extra_params, **params}
         )
-        state.memory = {**state.memory, **component_response.updated_context}
+        state.memory.update(component_response.updated_context)
 
     await emit_responses(state, component_response)
 
@@ -1,18 +1,31 @@
+import asyncio
+import gzip
 import logging
 import os
 import time
-import asyncio
 
 import traceback
 
-from typing import Optional
+from collections import OrderedDict
+from json import dumps
+from typing import Dict, Iterable, Optional, Tuple
 
 import httpx
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from sanic import Sanic
-from sanic.response import json
+from sanic.response import HTTPResponse, json, raw, text
 
-from agt.server import AgentSessionsManager
-from agt.state import Outputs
+from agt.hibernation import SessionStore
+from agt.http_pool import get_http_pool
+from agt.metrics import Metrics, format_metric, get_metrics
+from agt.server import AgentSessionsManager, BotSessionContainer
+from agt.state import BotEntry, Message, Outputs
+from agt.std.compiled import config_hash
 
 COCOHUB_URL = os.environ.get("COCOHUB_URL", "https://cocohub.ai")
 
@@ -20,6 +33,70 @@ logging.basicConfig(level=logging.DEBUG)
 logging.getLogger().addHandler(logging.FileHandler(filename="cocohub-agt.log"))
 
 
+# max items in an exchange_batch request and sessions running concurrently
+BATCH_MAX_ITEMS = int(os.environ.get("AGT_BATCH_MAX_ITEMS", 1000))
+BATCH_CONCURRENCY = int(os.environ.get("AGT_BATCH_CONCURRENCY", 64))
+
+# seconds hub component configs are cached, and unknown component ids are remembered
+COMPONENT_CONFIG_TTL = float(os.environ.get("AGT_COMPONENT_CONFIG_TTL", 300))
+COMPONENT_CONFIG_NOT_FOUND_TTL = float(os.environ.get("AGT_COMPONENT_CONFIG_NOT_FOUND_TTL", 30))
+# component ids cached (found or not), least recently used first out - ids come from urls
+COMPONENT_CONFIG_CACHE_SIZE = int(os.environ.get("AGT_COMPONENT_CONFIG_CACHE_SIZE", 1024))
+# comma separated hub component ids to fetch on startup
+WARM_COMPONENT_IDS = [
+    c for c in os.environ.get("AGT_WARM_COMPONENT_IDS", "").split(",") if c
+]
+
+# shared hub http client
+HUB_TIMEOUT = float(os.environ.get("AGT_HUB_TIMEOUT", 10))
+HUB_MAX_CONNECTIONS = int(os.environ.get("AGT_HUB_MAX_CONNECTIONS", 100))
+HUB_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("AGT_HUB_MAX_KEEPALIVE_CONNECTIONS", 20))
+
+
+# responses at least this many bytes are gzipped for clients accepting it
+GZIP_MIN_SIZE = int(os.environ.get("AGT_GZIP_MIN_SIZE", 1024))
+
+
+def encode_response(
+    request, data, status: int = 200, headers: Optional[dict] = None
+) -> HTTPResponse:
+    """
+    json response, msgpack for clients accepting application/msgpack (if msgpack is installed)
+    and gzipped if large and the client accepts gzip
+    """
+    if msgpack and "application/msgpack" in request.headers.get("accept", ""):
+        body = msgpack.packb(data)
+        content_type = "application/msgpack"
+    else:
+        body = dumps(data).encode("utf-8")
+        content_type = "application/json"
+
+    headers = dict(headers or {})
+    if len(body) >= GZIP_MIN_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return raw(body, status=status, content_type=content_type, headers=headers)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """
+    Server-Timing header value of durations in seconds
+    """
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items())
+
+
+def exchange_context(json_data: dict) -> dict:
+    """
+    context update for the turn from the exchange request
+    """
+    context = {}
+    if "source_language_code" in json_data:
+        context["source_language_code"] = json_data["source_language_code"]
+    context.update(json_data.get("context", {}))
+    return context
+
+
 async def fetch_component_config(http_client: httpx.AsyncClient, component_id: str) -> Optional[dict]:
     rv = await http_client.get(
         f"{COCOHUB_URL}/api/fetch_component_config/{component_id}"
@@ -28,23 +105,160 @@ async def fetch_component_config(http_client: httpx.AsyncClient, component_id: s
     return resp_json if "error" not in resp_json else None
 
 
+def hub_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(HUB_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HUB_MAX_CONNECTIONS,
+            max_keepalive_connections=HUB_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+    )
+
+
+class ComponentConfigCache:
+    """
+    fetch_component_config results by component id
+
+    Configs are kept for ttl seconds and not found ids for not_found_ttl seconds,
+    at most max_size ids (least recently used are dropped first),
+    concurrent fetches of the same id share one request.
+    Fetch errors are not cached.
+    """
+
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        ttl: float = COMPONENT_CONFIG_TTL,
+        not_found_ttl: float = COMPONENT_CONFIG_NOT_FOUND_TTL,
+        max_size: int = COMPONENT_CONFIG_CACHE_SIZE,
+    ) -> None:
+        self.http_client = http_client
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_size = max_size
+        # component id -> (expiry time, config or None if not found), least recently used first
+        self.configs: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, component_id: str) -> Optional[dict]:
+        """
+        component config (a copy that can be changed by the caller) or None if not found
+        """
+        loop = asyncio.get_event_loop()
+        cached = self.configs.get(component_id)
+        if cached and cached[0] > loop.time():
+            self.hits += 1
+            self.configs.move_to_end(component_id)
+            return dict(cached[1]) if cached[1] is not None else None
+
+        inflight = self.inflight.get(component_id)
+        if inflight is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # a task of its own - a cancelled caller (client gone) doesn't fail the others
+            inflight = self.inflight[component_id] = asyncio.ensure_future(
+                self.fetch(component_id)
+            )
+            # retrieved - waiters get it from their await, don't warn when there are none
+            inflight.add_done_callback(lambda f: f.cancelled() or f.exception())
+        config = await asyncio.shield(inflight)
+        return dict(config) if config is not None else None
+
+    async def fetch(self, component_id: str) -> Optional[dict]:
+        try:
+            config = await fetch_component_config(self.http_client, component_id)
+        finally:
+            del self.inflight[component_id]
+        ttl = self.ttl if config is not None else self.not_found_ttl
+        self.configs[component_id] = (asyncio.get_event_loop().time() + ttl, config)
+        self.configs.move_to_end(component_id)
+        while len(self.configs) > self.max_size:
+            self.configs.popitem(last=False)
+            self.evictions += 1
+        return config
+
+    async def warm_up(self, component_ids: Iterable[str]) -> None:
+        results = await asyncio.gather(
+            *[self.get(c) for c in component_ids], return_exceptions=True
+        )
+        for component_id, result in zip(component_ids, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Failed fetching component {component_id} config: {result}")
+
+    def invalidate(self, component_id: Optional[str] = None) -> None:
+        if component_id is None:
+            self.configs.clear()
+        else:
+            self.configs.pop(component_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.configs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
 class AgentCoCoApp:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        session_ttl: Optional[float] = None,
+        max_sessions: Optional[int] = None,
+        session_store: Optional[SessionStore] = None,
+        batch_max_items: Optional[int] = None,
+        batch_concurrency: Optional[int] = None,
+        warm_component_ids: Optional[Iterable[str]] = None,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
         self.blueprints: dict = {}
         self.blueprints_configs: dict = {}
         self.sanic_app = Sanic(__name__)
-        self.agent_session_mgr = AgentSessionsManager()
-        self.http_client = httpx.AsyncClient()
+        self.agent_session_mgr = AgentSessionsManager(
+            session_ttl=session_ttl,
+            max_sessions=max_sessions,
+            session_store=session_store,
+        )
+        self.http_client = hub_http_client()
+        self.component_configs = ComponentConfigCache(self.http_client)
+        self.warm_component_ids = list(warm_component_ids or WARM_COMPONENT_IDS)
+        # blueprint id -> etag of its published config
+        self.config_etags: Dict[str, str] = {}
+        self.batch_max_items = batch_max_items or BATCH_MAX_ITEMS
+        self.batch_concurrency = batch_concurrency or BATCH_CONCURRENCY
+        self.metrics = metrics or get_metrics()
         self.sanic_app.add_route(
             self.exchange, "/api/exchange/<blueprint_id>/<session_id>", methods=["POST"]
         )
         self.sanic_app.add_route(
             self.exchange, "/exchange/<blueprint_id>/<session_id>", methods=["POST"]
         )
+        self.sanic_app.add_route(
+            self.exchange_stream,
+            "/api/exchange_stream/<blueprint_id>/<session_id>",
+            methods=["POST"],
+        )
+        self.sanic_app.add_route(
+            self.exchange_stream,
+            "/exchange_stream/<blueprint_id>/<session_id>",
+            methods=["POST"],
+        )
+        self.sanic_app.add_route(
+            self.exchange_batch, "/api/exchange_batch", methods=["POST"]
+        )
+        self.sanic_app.add_route(
+            self.exchange_batch, "/exchange_batch", methods=["POST"]
+        )
         self.sanic_app.add_route(
             self.config, "/api/config/<blueprint_id>", methods=["GET"]
         )
         self.sanic_app.add_route(self.config, "/config/<blueprint_id>", methods=["GET"])
+        self.sanic_app.add_route(self.serve_metrics, "/metrics", methods=["GET"])
+        self.sanic_app.register_listener(self.warm_up, "before_server_start")
 
     def blueprint(self, f, config=None, component_id=None):
         async def component(*args, **kwargs):
@@ -58,27 +272,217 @@ class AgentCoCoApp:
         self.blueprints[component_id] = f
         if config:
             self.blueprints_configs[component_id] = config
+            self.config_etags.pop(component_id, None)
+
+    async def warm_up(self, *args):
+        if self.warm_component_ids:
+            await self.component_configs.warm_up(self.warm_component_ids)
 
     def run(self, *args, **kwargs):
         self.sanic_app.run(*args, **kwargs)
 
+    def after_fork(self) -> None:
+        """
+        reopen per process resources created in __init__, called in forked workers before run()
+        """
+        self.agent_session_mgr.after_fork()
+        self.http_client = self.component_configs.http_client = hub_http_client()
+
     async def exchange(self, request, blueprint_id, session_id):
         """
         Single exchange of user input with the bot.
         """
+        timings: Dict[str, float] = {}
+        eresp = await self.exchange_result(
+            blueprint_id, session_id, request.json or {}, timings=timings
+        )
+        return encode_response(
+            request,
+            eresp,
+            status=400 if "error" in eresp else 200,
+            headers={"Server-Timing": server_timing(timings)} if timings else None,
+        )
+
+    async def exchange_result(
+        self,
+        blueprint_id,
+        session_id,
+        json_data: dict,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> dict:
+        """
+        exchange response for a turn, {"error": ...} if the blueprint was not found
+
+        timings is filled with the seconds spent getting the session, in the bot turn and in total
+        """
+        start_time = time.perf_counter()
+        self.metrics.exchanges_in_flight += 1
+        try:
+            sc = await self.exchange_session(blueprint_id, session_id, json_data)
+            session_time = time.perf_counter()
+            if sc is None:
+                self.metrics.count_exchange_error("blueprint_not_found")
+                return {"error": f"Blueprint: {blueprint_id} not found"}
+
+            await sc.exchange_turn(
+                json_data.get("user_input", ""), exchange_context(json_data)
+            )
+            turn_time = time.perf_counter()
+
+            # taken before validating - a bad message must not fail the next exchanges as well
+            responses = sc.responses
+            sc.clear_responses()
+            eresp = {"responses": [Message.from_entry(r).dict() for r in responses]}
+            eresp.update(
+                self.turn_result(sc, context_delta=json_data.get("context_delta", False))
+            )
+
+            eresp["response_time"] = time.perf_counter() - start_time
+            if timings is not None:
+                timings["session"] = session_time - start_time
+                timings["turn"] = turn_time - session_time
+                timings["total"] = eresp["response_time"]
+            return eresp
+        finally:
+            self.metrics.exchanges_in_flight -= 1
+            self.metrics.exchange_latency.observe(time.perf_counter() - start_time)
+
+    async def exchange_batch(self, request):
+        """
+        Many exchanges in one request.
+
+        Body is a list (or {"items": [...]}) of exchange requests with blueprint_id and session_id,
+        returns {"results": [...]} in the same order - an exchange response or {"error": ...} per item.
+        Items of the same session run one after the other in order, different sessions run concurrently
+        (at most batch_concurrency sessions at a time).
+        """
+        items = request.json
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list):
+            return json({"error": "Expected a list of exchange items"}, status=400)
+        if len(items) > self.batch_max_items:
+            return json(
+                {"error": f"Batch of {len(items)} items, max is {self.batch_max_items}"},
+                status=400,
+            )
+
+        results: list = [None] * len(items)
+        items_by_session: dict = {}
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or "blueprint_id" not in item or "session_id" not in item:
+                results[i] = {"error": "Item must have blueprint_id and session_id"}
+                continue
+            items_by_session.setdefault(str(item["session_id"]), []).append(i)
+
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def run_session_items(indexes):
+            async with semaphore:
+                for i in indexes:
+                    item = items[i]
+                    try:
+                        results[i] = await self.exchange_result(
+                            item["blueprint_id"], str(item["session_id"]), item
+                        )
+                    except Exception as e:
+                        logging.exception(e)
+                        self.metrics.count_exchange_error("batch_item_exception")
+                        results[i] = {
+                            "error": traceback.format_exception_only(type(e), e)
+                        }
+
+        start_time = time.perf_counter()
+        await asyncio.gather(
+            *[run_session_items(indexes) for indexes in items_by_session.values()]
+        )
+        timings = {"total": time.perf_counter() - start_time}
+        return encode_response(
+            request, {"results": results}, headers={"Server-Timing": server_timing(timings)}
+        )
+
+    async def exchange_stream(self, request, blueprint_id, session_id):
+        """
+        Exchange streaming each bot message as it is said, then the turn result.
+
+        newline delimited json by default or server sent events with Accept: text/event-stream,
+        frames are {"type": "response", text, image_url, ssml}
+        and a final {"type": "result", component_done, out_of_context, ...}
+        """
         start_time = time.perf_counter()
+        self.metrics.exchanges_in_flight += 1
+        try:
+            json_data = request.json or {}
+
+            sc = await self.exchange_session(blueprint_id, session_id, json_data)
+            session_time = time.perf_counter()
+            if sc is None:
+                self.metrics.count_exchange_error("blueprint_not_found")
+                return json({"error": f"Blueprint: {blueprint_id} not found"}, status=400)
+
+            if "text/event-stream" in request.headers.get("accept", ""):
+                content_type = "text/event-stream"
+                frame_format = "data: {}\n\n"
+            else:
+                content_type = "application/x-ndjson"
+                frame_format = "{}\n"
+
+            # headers go out before the turn - only the session part of the timing is known
+            response = await request.respond(
+                content_type=content_type,
+                headers={"Server-Timing": server_timing({"session": session_time - start_time})},
+            )
 
-        json_data = request.json or {}
+            async def send_response(message: BotEntry):
+                frame = {"type": "response", **Message.from_entry(message).dict()}
+                try:
+                    await response.send(frame_format.format(dumps(frame)))
+                except Exception as e:
+                    # client went away - don't fail the bot
+                    logging.debug(f"exchange stream send failed: {e}")
 
+            # messages said between turns
+            for message in sc.responses:
+                await send_response(message)
+            sc.clear_responses()
+
+            sc.response_callback = send_response
+            try:
+                await sc.exchange_turn(
+                    json_data.get("user_input", ""), exchange_context(json_data)
+                )
+            finally:
+                sc.response_callback = None
+
+            result = {
+                "type": "result",
+                **self.turn_result(sc, context_delta=json_data.get("context_delta", False)),
+            }
+            result["response_time"] = time.perf_counter() - start_time
+            await response.send(frame_format.format(dumps(result)))
+            await response.eof()
+        finally:
+            self.metrics.exchanges_in_flight -= 1
+            self.metrics.exchange_latency.observe(time.perf_counter() - start_time)
+
+    async def exchange_session(
+        self, blueprint_id, session_id, json_data: dict
+    ) -> Optional[BotSessionContainer]:
+        """
+        session for the exchange, starting the blueprint (local or a cocohub component) if needed
+
+        None if the blueprint was not found
+        """
         config = None
+        # labelled by the requested (local or hub component) id once it is known to exist,
+        # so arbitrary ids in urls don't grow the metrics
+        metrics_id = blueprint_id
         if blueprint_id in self.blueprints:
             bp = self.blueprints[blueprint_id]
         elif session_id not in self.agent_session_mgr.sessions:
-            config = await fetch_component_config(self.http_client, blueprint_id)
+            config = await self.component_configs.get(blueprint_id)
             if not config:
-                return json(
-                    {"error": f"Blueprint: {blueprint_id} not found"}, status=400
-                )
+                return None
             config["component_id"] = blueprint_id
             blueprint_id = config["blueprint_id"]
 
@@ -86,61 +490,103 @@ class AgentCoCoApp:
         else:
             bp = None
 
+        blueprint_metrics = self.metrics.blueprint(metrics_id) if bp else None
+
         async def wrapped_bp(*args, **kwargs):
             if config:
                 kwargs["config"] = config
             try:
-                return await bp(*args, **json_data.get("parameters", {}), **kwargs)
+                result = await bp(*args, **json_data.get("parameters", {}), **kwargs)
             except Exception as e:
                 logging.exception(e)
-                return Outputs(
+                if blueprint_metrics is not None:
+                    blueprint_metrics.exceptions += 1
+                result = Outputs(
                     success=False, error=traceback.format_exception_only(type(e), e)
                 )
+            if (
+                blueprint_metrics is not None
+                and isinstance(result, Outputs)
+                and not result.success
+            ):
+                blueprint_metrics.failures += 1
+            return result
 
-        sc = self.agent_session_mgr.get_session(session_id, wrapped_bp)
-
-        if len(sc.out_of_context_input_event._waiters) > 0:
-            sc.out_of_context_input_event.set()
-
-        if "source_language_code" in json_data:
-            sc.conv_state.memory["source_language_code"] = json_data[
-                "source_language_code"
-            ]
-
-        sc.conv_state.memory.update(json_data.get("context", {}))
-
-        await sc.conv_state.put_user_input(json_data.get("user_input", ""))
-
-        await asyncio.wait(
-            [sc.conv_state.bot_listen(), sc.bot_task, sc.wait_for_out_of_context()],
-            return_when=asyncio.FIRST_COMPLETED,
+        return self.agent_session_mgr.get_session(
+            session_id, wrapped_bp, hooks=blueprint_metrics
         )
 
+    def turn_result(self, sc: BotSessionContainer, context_delta: bool = False) -> dict:
+        """
+        component state after the turn, resets the out of context flag for the next turn
+
+        with context_delta updated_context has only the memory keys changed this turn
+        and deleted_context_keys the keys removed
+        """
         outputs = Outputs()
-        if sc.bot_task.done():
+        if sc.bot_task.cancelled():
+            # evicted (or shut down) while the exchange waited for the turn
+            outputs = Outputs(success=False, error="Session evicted")
+        elif sc.bot_task.done():
             result = sc.bot_task.result()
             if result:
                 outputs = result
 
-        eresp = {
-            "responses": [
-                {"text": r.text, "image_url": r.image_url, "ssml": r.ssml}
-                for r in sc.responses
-            ],
+        result = {
             "component_done": sc.bot_task.done(),
             "component_failed": sc.bot_task.done() and not outputs.success,
             "out_of_context": sc.out_of_context_event.is_set(),
-            "updated_context": sc.conv_state.memory,
             "outputs": outputs.outputs,
         }
+        changed, deleted = sc.conv_state.memory.take_changes()
+        if context_delta:
+            result["updated_context"] = changed
+            result["deleted_context_keys"] = deleted
+        else:
+            result["updated_context"] = dict(sc.conv_state.memory)
 
-        sc.clear_responses()
         sc.out_of_context_event.clear()
+        return result
 
-        eresp["response_time"] = time.perf_counter() - start_time
-        return json(eresp)
+    async def serve_metrics(self, request):
+        """
+        prometheus text format metrics
+        """
+        sessions_stats = self.agent_session_mgr.stats()
+        http_pool_stats = get_http_pool().stats()
+        config_stats = self.component_configs.stats()
+        pending_inputs = sum(
+            sc.conv_state.pending_inputs() for sc in self.agent_session_mgr.sessions.values()
+        )
+        app_metrics = [
+            ("agt_active_sessions", "gauge", "live sessions", sessions_stats["active_sessions"]),
+            ("agt_pending_user_inputs", "gauge", "user inputs queued for bots", pending_inputs),
+            ("agt_sessions_ttl_evictions_total", "counter", "idle sessions evicted", sessions_stats["ttl_evictions"]),
+            ("agt_sessions_capacity_evictions_total", "counter", "sessions evicted over max_sessions", sessions_stats["capacity_evictions"]),
+            ("agt_sessions_hibernated_total", "counter", "sessions hibernated", sessions_stats["hibernated"]),
+            ("agt_sessions_restored_total", "counter", "sessions restored", sessions_stats["restored"]),
+            ("agt_http_requests_total", "counter", "remote http requests", http_pool_stats["requests"]),
+            ("agt_http_errors_total", "counter", "failed remote http requests", http_pool_stats["errors"]),
+            ("agt_http_in_flight", "gauge", "remote http requests in flight", http_pool_stats["in_flight"]),
+            ("agt_http_connections_opened_total", "counter", "remote connections opened", http_pool_stats["connections_opened"]),
+            ("agt_component_config_cache_hits_total", "counter", "hub config cache hits", config_stats["hits"]),
+            ("agt_component_config_cache_misses_total", "counter", "hub config cache misses", config_stats["misses"]),
+            ("agt_component_config_cache_evictions_total", "counter", "hub config cache ids dropped over the size limit", config_stats["evictions"]),
+        ]
+        lines = [self.metrics.render().rstrip("\n")]
+        for name, metric_type, description, value in app_metrics:
+            lines.extend(format_metric(name, metric_type, description, [(name, {}, value)]))
+        return text("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4")
 
     async def config(self, request, blueprint_id):
-        return json(
-            self.blueprints_configs.get(blueprint_id, {"blueprint_id": blueprint_id}),
-        )
+        config = self.blueprints_configs.get(blueprint_id, {"blueprint_id": blueprint_id})
+
+        etag = self.config_etags.get(blueprint_id)
+        if etag is None:
+            etag = f'"{config_hash({"config": config})}"'
+            if blueprint_id in self.blueprints_configs:
+                self.config_etags[blueprint_id] = etag
+        if request.headers.get("if-none-match") == etag:
+            return HTTPResponse(status=304, headers={"ETag": etag})
+
+        return json(config, headers={"ETag": etag})
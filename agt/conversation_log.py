@@ -0,0 +1,217 @@
+"""
+    Bounded conversation log
+
+    Keeps the last `retention` entries in memory (all of them if retention is None),
+    older entries are dropped or spilled to an append-only gzipped jsonl file.
+    Spill files are written from a single thread, in order, off the event loop.
+"""
+import gzip
+import json
+import logging
+import sys
+import typing as ta
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pydantic import BaseModel
+
+
+class Entry:
+    __slots__ = ("text", "image_url", "ssml")
+
+    def __init__(
+        self,
+        text: str = None,
+        image_url: ta.Optional[str] = None,
+        ssml: ta.Optional[str] = None,
+    ):
+        self.text = text
+        self.image_url = image_url
+        self.ssml = ssml
+
+    def __repr__(self):
+        if self.image_url:
+            return " #img#: ".join([self.text or "", self.image_url])
+        return self.text or ""
+
+    def __str__(self):
+        return self.text or ""
+
+    def dict(self) -> dict:
+        return {"text": self.text, "image_url": self.image_url, "ssml": self.ssml}
+
+
+class Message(BaseModel):
+    """
+    Validated bot message for the http boundary, internally messages are BotEntry objects
+    """
+
+    text: str
+    image_url: ta.Optional[str]
+    ssml: ta.Optional[str]
+
+    @classmethod
+    def from_entry(cls, entry: Entry) -> "Message":
+        return cls(text=entry.text, image_url=entry.image_url, ssml=entry.ssml)
+
+
+class BotEntry(Entry):
+    """
+    A bot message - the same object is logged and passed to the output callback
+
+    Output callbacks used to get a Message, json() / copy() and dict() with arguments
+    still behave as they did on it.
+    """
+
+    __slots__ = ()
+
+    def __init__(
+        self,
+        text: str = None,
+        image_url: ta.Optional[str] = None,
+        ssml: ta.Optional[str] = None,
+    ):
+        # bot lines repeat across turns and sessions - keep a single copy
+        if type(text) is str:
+            text = sys.intern(text)
+        super().__init__(text=text, image_url=image_url, ssml=ssml)
+
+    def __repr__(self):
+        return f"BOT >> {super().__repr__()}"
+
+    def to_message(self) -> Message:
+        return Message.from_entry(self)
+
+    def dict(self, **kwargs) -> dict:
+        if kwargs:
+            return self.to_message().dict(**kwargs)
+        return super().dict()
+
+    def json(self, **kwargs) -> str:
+        return self.to_message().json(**kwargs)
+
+    def copy(self, **kwargs) -> Message:
+        return self.to_message().copy(**kwargs)
+
+
+class UserEntry(Entry):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f"USER >> {super().__repr__()}"
+
+
+ENTRY_TYPES = {"bot": BotEntry, "user": UserEntry}
+
+logger = logging.getLogger("agt")
+
+spill_executor = ThreadPoolExecutor(1, thread_name_prefix="agt-log-spill")
+
+
+def write_spilled(path: str, entries: ta.List[Entry]) -> None:
+    # errors are logged - a full disk must not kill the conversation
+    try:
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            for entry in entries:
+                entry_type = "bot" if isinstance(entry, BotEntry) else "user"
+                f.write(
+                    json.dumps(
+                        {
+                            "type": entry_type,
+                            "text": entry.text,
+                            "image_url": entry.image_url,
+                            "ssml": entry.ssml,
+                        }
+                    )
+                    + "\n"
+                )
+    except OSError as e:
+        logger.exception(e)
+
+
+class ConversationLog:
+    # spilled entries are written in batches to avoid reopening the file per entry
+    SPILL_BATCH = 64
+
+    def __init__(
+        self, retention: ta.Optional[int] = None, spill_path: ta.Optional[str] = None
+    ) -> None:
+        self.entries: ta.Deque[Entry] = deque()
+        self.retention = retention
+        self.spill_path = spill_path
+        self.spill_buffer: ta.List[Entry] = []
+        # the last write submitted to the spill thread
+        self.spill_pending: ta.Optional[Future] = None
+        self.last_user_entry: ta.Optional[UserEntry] = None
+        self.last_bot_entry: ta.Optional[BotEntry] = None
+
+    def append(self, entry: Entry) -> None:
+        if isinstance(entry, UserEntry):
+            self.last_user_entry = entry
+        elif isinstance(entry, BotEntry):
+            self.last_bot_entry = entry
+
+        if self.retention is not None and len(self.entries) >= self.retention:
+            dropped = self.entries.popleft()
+            if self.spill_path:
+                self.spill_buffer.append(dropped)
+                if len(self.spill_buffer) >= self.SPILL_BATCH:
+                    self.flush()
+        self.entries.append(entry)
+
+    def flush(self) -> None:
+        """
+        write buffered dropped entries to the spill file (in the spill thread)
+        """
+        if not self.spill_buffer or not self.spill_path:
+            return
+        self.spill_pending = spill_executor.submit(
+            write_spilled, self.spill_path, self.spill_buffer
+        )
+        self.spill_buffer = []
+
+    def read_spilled(self) -> ta.Iterator[Entry]:
+        """
+        entries dropped from memory, oldest first
+        """
+        self.flush()
+        if self.spill_pending is not None:
+            self.spill_pending.result()
+        if not self.spill_path:
+            return
+        try:
+            with gzip.open(self.spill_path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    e = json.loads(line)
+                    yield ENTRY_TYPES[e["type"]](
+                        text=e["text"], image_url=e["image_url"], ssml=e["ssml"]
+                    )
+        except FileNotFoundError:
+            return
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> ta.Iterator[Entry]:
+        return iter(self.entries)
+
+    def __reversed__(self) -> ta.Iterator[Entry]:
+        return reversed(self.entries)
+
+    @ta.overload
+    def __getitem__(self, index: int) -> Entry:
+        ...
+
+    @ta.overload
+    def __getitem__(self, index: slice) -> ta.List[Entry]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # a list like the log used to be, deque indexing is cheap near both ends
+            return [self.entries[i] for i in range(*index.indices(len(self.entries)))]
+        return self.entries[index]
+
+    def __repr__(self):
+        return repr(list(self.entries))
@@ -0,0 +1,151 @@
+"""
+    Session hibernation stores
+
+    A hibernated session is kept as its session id, memory and the log of user turns.
+    It is rebuilt by replaying the turns through the bot with output suppressed,
+    so it fits bots that act deterministically on their inputs -
+    remote components called with agt.coco are called again during replay.
+"""
+import abc
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import typing as ta
+
+
+class SessionSnapshot:
+    def __init__(
+        self,
+        session_id: str,
+        memory: dict,
+        turns: ta.List[ta.Tuple[dict, str]],
+    ) -> None:
+        self.session_id = session_id
+        self.memory = memory
+        # (context update, user input) per turn
+        self.turns = turns
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {"session_id": self.session_id, "memory": self.memory, "turns": self.turns}
+        )
+
+    @classmethod
+    def loads(cls, data: str) -> "SessionSnapshot":
+        snapshot = json.loads(data)
+        return cls(
+            snapshot["session_id"],
+            snapshot["memory"],
+            [(context, user_input) for context, user_input in snapshot["turns"]],
+        )
+
+
+class SessionStore(abc.ABC):
+    """
+    Persistence for hibernated sessions by the AgentSessionsManager session key
+    """
+
+    @abc.abstractmethod
+    def save(self, key: str, snapshot: SessionSnapshot) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load(self, key: str) -> ta.Optional[SessionSnapshot]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def reopen(self) -> None:
+        """
+        drop per process resources (connections) in a forked worker, nothing by default
+        """
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str = "agt-sessions.db") -> None:
+        self.path = path
+        self._connection: ta.Optional[sqlite3.Connection] = None
+        self.connection_pid: ta.Optional[int] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        opened on first use in each process - a connection must not be used across fork()
+        (agt serve --workers)
+        """
+        if self._connection is None or self.connection_pid != os.getpid():
+            # used from the AgentSessionsManager store thread, one call at a time
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection_pid = os.getpid()
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, snapshot TEXT)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def reopen(self):
+        # not closed - closing the inherited connection would touch the parent's database state
+        self._connection = None
+
+    def save(self, key, snapshot):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sessions (key, snapshot) VALUES (?, ?)",
+            (key, snapshot.dumps()),
+        )
+        self.connection.commit()
+
+    def load(self, key):
+        row = self.connection.execute(
+            "SELECT snapshot FROM sessions WHERE key = ?", (key,)
+        ).fetchone()
+        return SessionSnapshot.loads(row[0]) if row else None
+
+    def delete(self, key):
+        self.connection.execute("DELETE FROM sessions WHERE key = ?", (key,))
+        self.connection.commit()
+
+
+class FileSessionStore(SessionStore):
+    """
+    json file per session in a directory
+    """
+
+    def __init__(self, directory: str = "agt-sessions") -> None:
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.directory / (hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def save(self, key, snapshot):
+        path = self.path(key)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(snapshot.dumps())
+        os.replace(tmp_path, path)
+
+    def load(self, key):
+        path = self.path(key)
+        if not path.exists():
+            return None
+        return SessionSnapshot.loads(path.read_text())
+
+    def delete(self, key):
+        path = self.path(key)
+        if path.exists():
+            path.unlink()
+
+
+def session_store_from_url(url: str) -> SessionStore:
+    """
+    sqlite:<path> or file:<directory>
+    """
+    scheme, _, location = url.partition(":")
+    if scheme == "sqlite":
+        return SQLiteSessionStore(location)
+    elif scheme == "file":
+        return FileSessionStore(location)
+    raise ValueError(f"Unknown session store {url}, expected sqlite:<path> or file:<directory>")
@@ -0,0 +1,182 @@
+"""
+    Shared http client for remote component calls
+
+    coco() and navigation call the hub through one keep-alive connection pool
+    instead of opening a new client (and connection / TLS handshake) per call.
+    The pool is configured with AGT_HTTP_* environment variables or configure_http_pool().
+"""
+import asyncio
+import os
+import time
+import typing as ta
+
+from urllib.parse import urlsplit
+
+import httpx
+
+from coco.coco import CoCoIntentResult, CoCoResponse
+
+COCOHUB_URL = os.environ.get("COCOHUB_URL", "https://cocohub.ai")
+
+HTTP_TIMEOUT = float(os.environ.get("AGT_HTTP_TIMEOUT", 30))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("AGT_HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("AGT_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("AGT_HTTP_KEEPALIVE_EXPIRY", 30))
+# concurrent requests per host (unlimited if unset)
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("AGT_HTTP_MAX_CONNECTIONS_PER_HOST", 0)) or None
+
+
+class HttpPool:
+    """
+    Lazily created httpx client, one per event loop (connections can't move between loops)
+    """
+
+    def __init__(
+        self,
+        base_url: str = COCOHUB_URL,
+        timeout: float = HTTP_TIMEOUT,
+        max_connections: ta.Optional[int] = HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: ta.Optional[int] = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: ta.Optional[float] = HTTP_KEEPALIVE_EXPIRY,
+        max_connections_per_host: ta.Optional[int] = HTTP_MAX_CONNECTIONS_PER_HOST,
+    ) -> None:
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_connections_per_host = max_connections_per_host
+        self._client: ta.Optional[httpx.AsyncClient] = None
+        self._loop: ta.Optional[asyncio.AbstractEventLoop] = None
+        self._host_semaphores: ta.Dict[str, asyncio.Semaphore] = {}
+
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.connections_opened = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_event_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+            self._loop = loop
+            self._host_semaphores = {}
+        return self._client
+
+    def host_semaphore(self, url: str) -> ta.Optional[asyncio.Semaphore]:
+        if not self.max_connections_per_host:
+            return None
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(
+                self.max_connections_per_host
+            )
+        return semaphore
+
+    async def trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.started":
+            self.connections_opened += 1
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        client = self.client
+        semaphore = self.host_semaphore(url)
+        if semaphore is not None:
+            await semaphore.acquire()
+
+        self.requests += 1
+        self.in_flight += 1
+        start_time = time.perf_counter()
+        try:
+            response = await client.post(url, extensions={"trace": self.trace}, **kwargs)
+            if response.is_error:
+                self.errors += 1
+            return response
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            latency = time.perf_counter() - start_time
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.in_flight -= 1
+            if semaphore is not None:
+                semaphore.release()
+
+    async def exchange(
+        self, component_id: str, session_id: str, user_input: str = None, **kwargs
+    ) -> CoCoResponse:
+        """
+        coco exchange, same as coco.async_api.exchange
+        """
+        payload = kwargs
+        if user_input:
+            payload = {"user_input": user_input, **kwargs}
+        response = await self.post(
+            f"{self.base_url}/api/exchange/{component_id}/{session_id}", json=payload
+        )
+        raise_for_server_error(response)
+        coco_resp: dict = response.json()
+        return CoCoResponse(**coco_resp, raw_resp=coco_resp)
+
+    async def query_intents(
+        self, intent_names: ta.List[str], query: str = ""
+    ) -> ta.List[CoCoIntentResult]:
+        """
+        coco intents query, same as coco.async_api.query_intents
+        """
+        response = await self.post(
+            f"{self.base_url}/v2/intent/query",
+            json={"query": query, "intent_names": intent_names},
+        )
+        raise_for_server_error(response)
+        return [CoCoIntentResult(**r) for r in response.json()]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "connections_opened": self.connections_opened,
+            "latency_avg": self.latency_total / self.requests if self.requests else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+
+def raise_for_server_error(response: httpx.Response) -> None:
+    """
+    a hub failure is an error - its error body isn't a component response
+    """
+    if response.status_code >= 500:
+        response.raise_for_status()
+
+
+http_pool = HttpPool()
+
+
+def configure_http_pool(**kwargs) -> HttpPool:
+    """
+    replace the shared pool, takes HttpPool arguments
+    """
+    global http_pool
+    http_pool = HttpPool(**kwargs)
+    return http_pool
+
+
+def set_http_pool(pool: HttpPool) -> None:
+    global http_pool
+    http_pool = pool
+
+
+def get_http_pool() -> HttpPool:
+    return http_pool
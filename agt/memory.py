@@ -0,0 +1,84 @@
+"""
+    Conversation memory with change tracking
+
+    Memory is a dict that records which keys were set or deleted since the last take_changes(),
+    so exchanges can send only what changed in a turn instead of the whole memory.
+    Changes inside values (e.g. appending to a list in memory) are not seen, nor is assigning
+    an equal value - assign a new (copied) value to mark it changed.
+"""
+import typing as ta
+
+_missing = object()
+
+
+class Memory(dict):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.changed_keys: ta.Set[ta.Any] = set(self)
+        self.deleted_keys: ta.Set[ta.Any] = set()
+
+    def __setitem__(self, key, value) -> None:
+        current = self.get(key, _missing)
+        super().__setitem__(key, value)
+        # assigning an equal value is not a change (coco() and clients resend the same context)
+        if current is not value and current != value:
+            self.changed_keys.add(key)
+            self.deleted_keys.discard(key)
+
+    def __delitem__(self, key) -> None:
+        super().__delitem__(key)
+        self.changed_keys.discard(key)
+        self.deleted_keys.add(key)
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, default=_missing):
+        if key in self:
+            value = super().pop(key)
+            self.changed_keys.discard(key)
+            self.deleted_keys.add(key)
+            return value
+        if default is _missing:
+            raise KeyError(key)
+        return default
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.changed_keys.discard(key)
+        self.deleted_keys.add(key)
+        return key, value
+
+    def clear(self) -> None:
+        self.deleted_keys.update(self)
+        self.changed_keys.clear()
+        super().clear()
+
+    def replace(self, memory: dict) -> None:
+        """
+        set the content to memory, marking only keys with different values as changed
+        """
+        for key in [k for k in self if k not in memory]:
+            del self[key]
+        for key, value in memory.items():
+            self[key] = value
+
+    def take_changes(self) -> ta.Tuple[dict, ta.List[ta.Any]]:
+        """
+        (changed keys and their values, deleted keys) since the last call
+        """
+        changed = {key: self[key] for key in self.changed_keys}
+        deleted = list(self.deleted_keys)
+        self.changed_keys = set()
+        self.deleted_keys = set()
+        return changed, deleted
@@ -0,0 +1,261 @@
+"""
+    Metrics in the prometheus text format
+
+    Counters and fixed bucket histograms updated in place (no locks, no allocation per event),
+    so collection stays on in production. Conversation events come from StateHooks attached to
+    the sessions of each blueprint, remote call timings from coco().
+    AgentCoCoApp serves them on /metrics with its sessions and http pool gauges.
+"""
+import bisect
+import typing as ta
+
+from agt.state import BotEntry, ConversationState, StateHooks
+
+# seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = ta.Dict[str, str]
+Sample = ta.Tuple[str, Labels, float]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: ta.Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        # observations per bucket (not cumulative), the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: Labels) -> ta.List[Sample]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append((f"{name}_bucket", {**labels, "le": le}, cumulative))
+        samples.append((f"{name}_sum", labels, self.sum))
+        samples.append((f"{name}_count", labels, self.count))
+        return samples
+
+
+class BlueprintMetrics(StateHooks):
+    """
+    conversation events of all the sessions of a blueprint
+    """
+
+    def __init__(self, metrics: "Metrics", blueprint_id: str) -> None:
+        self.metrics = metrics
+        self.blueprint_id = blueprint_id
+        self.turn_latency = Histogram(metrics.buckets)
+        self.turns_started = 0
+        self.bot_messages = 0
+        self.user_inputs = 0
+        self.out_of_context_events = 0
+        # blueprint runs ending with an exception / unsuccessful outputs (including exceptions)
+        self.exceptions = 0
+        self.failures = 0
+
+    def turn_start(self, state: ConversationState) -> None:
+        self.turns_started += 1
+
+    def turn_end(self, state: ConversationState, seconds: float) -> None:
+        self.turn_latency.observe(seconds)
+
+    def say(self, state: ConversationState, message: BotEntry) -> None:
+        self.bot_messages += 1
+
+    def user_input(self, state: ConversationState, user_input: str) -> None:
+        self.user_inputs += 1
+
+    def out_of_context(self, state: ConversationState, user_input: str) -> None:
+        self.out_of_context_events += 1
+
+    def remote_call(
+        self, state: ConversationState, component_id: str, seconds: float, failed: bool
+    ) -> None:
+        self.metrics.observe_remote_call(component_id, seconds, failed)
+
+
+class Metrics:
+    def __init__(self, buckets: ta.Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.blueprints: ta.Dict[str, BlueprintMetrics] = {}
+        # coco() calls by component id
+        self.remote_latency: ta.Dict[str, Histogram] = {}
+        self.remote_failures: ta.Dict[str, int] = {}
+        # exchange requests, whatever the blueprint
+        self.exchange_latency = Histogram(self.buckets)
+        self.exchanges_in_flight = 0
+        # reason -> count
+        self.exchange_errors: ta.Dict[str, int] = {}
+
+    def blueprint(self, blueprint_id: str) -> BlueprintMetrics:
+        blueprint_metrics = self.blueprints.get(blueprint_id)
+        if blueprint_metrics is None:
+            blueprint_metrics = self.blueprints[blueprint_id] = BlueprintMetrics(
+                self, blueprint_id
+            )
+        return blueprint_metrics
+
+    def observe_remote_call(self, component_id: str, seconds: float, failed: bool) -> None:
+        histogram = self.remote_latency.get(component_id)
+        if histogram is None:
+            histogram = self.remote_latency[component_id] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        if failed:
+            self.remote_failures[component_id] = self.remote_failures.get(component_id, 0) + 1
+
+    def count_exchange_error(self, reason: str) -> None:
+        self.exchange_errors[reason] = self.exchange_errors.get(reason, 0) + 1
+
+    def render(self) -> str:
+        blueprints = sorted(self.blueprints.items())
+        components = sorted(self.remote_latency.items())
+        lines: ta.List[str] = []
+
+        def counter(name, description, values):
+            lines.extend(
+                format_metric(
+                    name,
+                    "counter",
+                    description,
+                    [(name, {"blueprint": b}, getattr(m, values)) for b, m in blueprints],
+                )
+            )
+
+        lines.extend(
+            format_metric(
+                "agt_turn_seconds",
+                "histogram",
+                "bot turn latency, from the user input until the bot waits, ends or is out of context",
+                [
+                    sample
+                    for b, m in blueprints
+                    for sample in m.turn_latency.samples(
+                        "agt_turn_seconds", {"blueprint": b}
+                    )
+                ],
+            )
+        )
+        lines.extend(
+            format_metric(
+                "agt_turns_in_progress",
+                "gauge",
+                "turns waiting for the bot",
+                [
+                    (
+                        "agt_turns_in_progress",
+                        {"blueprint": b},
+                        m.turns_started - m.turn_latency.count,
+                    )
+                    for b, m in blueprints
+                ],
+            )
+        )
+        counter("agt_bot_messages_total", "messages said by the bot", "bot_messages")
+        counter("agt_user_inputs_total", "user inputs read by the bot", "user_inputs")
+        counter(
+            "agt_out_of_context_total", "out of context user inputs", "out_of_context_events"
+        )
+        counter(
+            "agt_blueprint_exceptions_total", "blueprint runs ending in an exception", "exceptions"
+        )
+        counter(
+            "agt_blueprint_failures_total", "blueprint runs ending unsuccessfully", "failures"
+        )
+
+        lines.extend(
+            format_metric(
+                "agt_remote_call_seconds",
+                "histogram",
+                "coco() remote component exchange latency",
+                [
+                    sample
+                    for c, h in components
+                    for sample in h.samples("agt_remote_call_seconds", {"component": c})
+                ],
+            )
+        )
+        lines.extend(
+            format_metric(
+                "agt_remote_call_failures_total",
+                "counter",
+                "failed coco() remote component exchanges",
+                [
+                    (
+                        "agt_remote_call_failures_total",
+                        {"component": c},
+                        self.remote_failures.get(c, 0),
+                    )
+                    for c, _ in components
+                ],
+            )
+        )
+
+        lines.extend(
+            format_metric(
+                "agt_exchange_seconds",
+                "histogram",
+                "exchange request latency",
+                self.exchange_latency.samples("agt_exchange_seconds", {}),
+            )
+        )
+        lines.extend(
+            format_metric(
+                "agt_exchanges_in_flight",
+                "gauge",
+                "exchange requests being handled",
+                [("agt_exchanges_in_flight", {}, self.exchanges_in_flight)],
+            )
+        )
+        lines.extend(
+            format_metric(
+                "agt_exchange_errors_total",
+                "counter",
+                "exchange requests failed before reaching a bot",
+                [
+                    ("agt_exchange_errors_total", {"reason": reason}, count)
+                    for reason, count in sorted(self.exchange_errors.items())
+                ],
+            )
+        )
+        return "\n".join(lines) + "\n"
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_sample(name: str, labels: Labels, value: float) -> str:
+    if labels:
+        label_pairs = ",".join(f'{k}="{escape_label_value(v)}"' for k, v in labels.items())
+        return f"{name}{{{label_pairs}}} {value}"
+    return f"{name} {value}"
+
+
+def format_metric(
+    name: str, metric_type: str, description: str, samples: ta.Iterable[Sample]
+) -> ta.List[str]:
+    return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"] + [
+        format_sample(*sample) for sample in samples
+    ]
+
+
+_metrics: ta.Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    """
+    process wide metrics (used by AgentCoCoApp unless given its own)
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
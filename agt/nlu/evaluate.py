@@ -0,0 +1,207 @@
+"""
+    Batch evaluation of intents over utterance corpora
+
+    corpus is JSONL (one json object per line) or CSV (with a header row),
+    each record has the utterance text and optionally the expected label
+"""
+import csv
+import importlib
+import itertools
+import json
+import sys
+import time
+import typing as ta
+
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from agt.nlu.word_regex import Slots
+
+NO_INTENT = "<none>"
+
+
+def load_object(path: str):
+    """
+    load an object from module_a.module_b:object_name
+    """
+    if "." not in sys.path:
+        sys.path.append(".")
+    module_path, object_name = path.rsplit(":", maxsplit=1)
+    module = importlib.import_module(module_path)
+    return getattr(module, object_name)
+
+
+def load_intents(path: str) -> ta.Dict[str, ta.Callable[[str], bool]]:
+    """
+    intents by name from a dict of intents or a single intent
+    """
+    intents = load_object(path)
+    if isinstance(intents, dict):
+        return intents
+    return {path.rsplit(":", maxsplit=1)[1]: intents}
+
+
+def read_corpus(
+    path: str, text_field: str = "text", label_field: str = "label"
+) -> ta.Iterator[ta.Tuple[str, ta.Optional[str]]]:
+    """
+    stream (utterance, label) pairs from a JSONL or CSV file
+    """
+    with open(path, "r", newline="") as f:
+        if path.endswith(".csv"):
+            records: ta.Iterable[dict] = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            label = record.get(label_field)
+            yield record[text_field], str(label) if label is not None else None
+
+
+class EvalReport:
+    def __init__(self) -> None:
+        self.total = 0
+        self.labeled = 0
+        self.correct = 0
+        self.hits: Counter = Counter()
+        self.confusion: ta.Dict[str, Counter] = defaultdict(Counter)
+        self.elapsed = 0.0
+
+    def merge(self, other: "EvalReport") -> None:
+        self.total += other.total
+        self.labeled += other.labeled
+        self.correct += other.correct
+        self.hits.update(other.hits)
+        for label, predictions in other.confusion.items():
+            self.confusion[label].update(predictions)
+
+    @property
+    def utterances_per_sec(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def dict(self) -> dict:
+        return {
+            "total": self.total,
+            "labeled": self.labeled,
+            "accuracy": self.correct / self.labeled if self.labeled else None,
+            "hits": dict(self.hits),
+            "confusion": {label: dict(p) for label, p in self.confusion.items()},
+            "elapsed": self.elapsed,
+            "utterances_per_sec": self.utterances_per_sec,
+        }
+
+    def format(self) -> str:
+        lines = [
+            f"utterances: {self.total} in {self.elapsed:.2f}s ({self.utterances_per_sec:.0f} utterances/sec)"
+        ]
+        if self.labeled:
+            lines.append(
+                f"accuracy: {self.correct / self.labeled:.4f} ({self.correct}/{self.labeled})"
+            )
+        lines.append("")
+        lines.append("hits per intent:")
+        for name, count in self.hits.most_common():
+            lines.append(f"  {name}: {count}")
+        if self.confusion:
+            columns = sorted({p for c in self.confusion.values() for p in c})
+            width = max(len(c) for c in columns + list(self.confusion) + ["label"])
+            lines.append("")
+            lines.append("confusion matrix (rows - label, columns - first matching intent):")
+            lines.append(
+                " ".join(["label".ljust(width)] + [c.rjust(width) for c in columns])
+            )
+            for label in sorted(self.confusion):
+                lines.append(
+                    " ".join(
+                        [label.ljust(width)]
+                        + [str(self.confusion[label][c]).rjust(width) for c in columns]
+                    )
+                )
+        return "\n".join(lines)
+
+
+def chunked(iterable: ta.Iterable, size: int) -> ta.Iterator[list]:
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def match_many(
+    intent: ta.Callable[[str], ta.Any], user_inputs: ta.List[str]
+) -> ta.Iterator[bool]:
+    """
+    match a batch with the intent batch api (Slots match when they extract a slot),
+    one call per utterance for other callables
+    """
+    if isinstance(intent, Slots):
+        return (bool(slots) for slots in intent.extract_many(user_inputs))
+    if hasattr(intent, "match_many"):
+        return intent.match_many(user_inputs)
+    return (bool(intent(user_input)) for user_input in user_inputs)
+
+
+def evaluate(
+    intents: ta.Dict[str, ta.Callable[[str], bool]],
+    samples: ta.Iterable[ta.Tuple[str, ta.Optional[str]]],
+    batch_size: int = 1000,
+) -> EvalReport:
+    names = list(intents.keys())
+    report = EvalReport()
+    for batch in chunked(samples, batch_size):
+        user_inputs = [user_input for user_input, _ in batch]
+        # matches per intent over the batch, then per utterance
+        columns = [list(match_many(intent, user_inputs)) for intent in intents.values()]
+        rows = zip(*columns) if columns else [()] * len(batch)
+        for (_, label), row in zip(batch, rows):
+            matches = [i for i, matched in enumerate(row) if matched]
+            report.total += 1
+            report.hits.update(names[i] for i in matches)
+            if label is not None:
+                predicted = names[matches[0]] if matches else NO_INTENT
+                report.labeled += 1
+                report.correct += predicted == label
+                report.confusion[label][predicted] += 1
+    return report
+
+
+worker_intents: ta.Dict[str, ta.Callable[[str], bool]] = {}
+
+
+def init_worker(intents_path: str) -> None:
+    worker_intents.update(load_intents(intents_path))
+
+
+def evaluate_chunk(samples: ta.List[ta.Tuple[str, ta.Optional[str]]]) -> EvalReport:
+    return evaluate(worker_intents, samples)
+
+
+def evaluate_corpus(
+    intents_path: str,
+    samples: ta.Iterable[ta.Tuple[str, ta.Optional[str]]],
+    workers: int = 1,
+    chunk_size: int = 1000,
+) -> EvalReport:
+    """
+    evaluate intents (module:name) over samples fanned out to a pool of worker processes
+    """
+    start_time = time.perf_counter()
+    if workers <= 1:
+        report = evaluate(load_intents(intents_path), samples)
+    else:
+        report = EvalReport()
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(intents_path,)
+        ) as executor:
+            pending: set = set()
+            for chunk in chunked(samples, chunk_size):
+                # bound the chunks in flight so huge corpora are streamed
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report.merge(future.result())
+                pending.add(executor.submit(evaluate_chunk, chunk))
+            for future in wait(pending).done:
+                report.merge(future.result())
+    report.elapsed = time.perf_counter() - start_time
+    return report
@@ -1,4 +1,7 @@
 import re
+import typing as ta
+
+from agt.nlu.utterance import Utterance
 
 
 class RegexIntent:
@@ -6,11 +9,24 @@ class RegexIntent:
         self.patterns = [re.compile(p, re.IGNORECASE) for p in patterns]
 
     def __call__(self, user_input):
+        if isinstance(user_input, Utterance):
+            return user_input.memoize(self, self.match)
+        return self.match(user_input)
+
+    def match(self, user_input):
         for p in self.patterns:
             if p.match(user_input):
                 return True
         return False
 
+    def match_many(self, user_inputs: ta.Iterable[str]) -> ta.Iterator[bool]:
+        """
+        lazily match a stream of utterances
+        """
+        matches = [p.match for p in self.patterns]
+        for user_input in user_inputs:
+            yield any(match(user_input) for match in matches)
+
 
 class RegexExtractor:
     def __init__(self, pattern, target_group) -> None:
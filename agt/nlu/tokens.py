@@ -0,0 +1,229 @@
+"""
+    Token based matching backend for word patterns
+
+    The utterance is tokenized once (words and punctuation runs, whitespace dropped)
+    and pattern elements are matched over the token array with dynamic programming,
+    O(elements x tokens) regardless of the input - no backtracking blowup on long or adversarial inputs.
+
+    Differences from the regex backend:
+    - whitespace is insignificant and tokens are compared case insensitive
+    - WordsRegex matches a single token
+    - extracted values are trimmed to token boundaries
+"""
+import abc
+import re
+import typing as ta
+
+from functools import lru_cache
+
+TOKEN_REGEX = re.compile(r"(\w+)|[^\w\s]+")
+
+
+class Tokens:
+    __slots__ = ("text", "tokens", "lowered", "spans", "word_runs")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.tokens: ta.List[str] = []
+        self.spans: ta.List[ta.Tuple[int, int]] = []
+        is_word = []
+        for m in TOKEN_REGEX.finditer(text):
+            self.tokens.append(m.group())
+            self.spans.append(m.span())
+            is_word.append(m.lastindex == 1)
+        self.lowered = [t.lower() for t in self.tokens]
+
+        # number of consecutive word tokens starting at each position
+        self.word_runs = [0] * (len(self.tokens) + 1)
+        for p in range(len(self.tokens) - 1, -1, -1):
+            self.word_runs[p] = self.word_runs[p + 1] + 1 if is_word[p] else 0
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def span_text(self, start: int, end: int) -> str:
+        if end <= start:
+            return ""
+        return self.text[self.spans[start][0] : self.spans[end - 1][1]]
+
+
+@lru_cache(maxsize=256)
+def tokenize(text: str) -> Tokens:
+    return Tokens(text)
+
+
+def tokens_of(user_input: str) -> Tokens:
+    """
+    tokens already analyzed for the input (agt.nlu.utterance.Utterance) or tokenize it
+    """
+    tokens = getattr(user_input, "tokens", None)
+    if isinstance(tokens, Tokens):
+        return tokens
+    return tokenize(user_input)
+
+
+class TokenElement(abc.ABC):
+    """
+    Element matched over a token array
+    """
+
+    @abc.abstractmethod
+    def reverse(self, tokens: Tokens, next_reachable: ta.List[bool]) -> ta.List[bool]:
+        """
+        positions the element can start at and end at a next_reachable position
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def ends(self, tokens: Tokens, start: int) -> ta.Iterable[int]:
+        """
+        end positions from start in order of preference (like the regex backend)
+        """
+        raise NotImplementedError
+
+
+class TokenWords(TokenElement):
+    def __init__(self, *words: str) -> None:
+        self.alternatives = [
+            tuple(m.group().lower() for m in TOKEN_REGEX.finditer(w)) for w in words
+        ] or [()]
+        self.by_first_token: ta.Dict[str, ta.List[ta.Tuple[str, ...]]] = {}
+        for alternative in self.alternatives:
+            if alternative:
+                self.by_first_token.setdefault(alternative[0], []).append(alternative)
+        self.matches_empty = () in self.alternatives
+
+    def reverse(self, tokens, next_reachable):
+        reachable = [False] * len(next_reachable)
+        lowered = tokens.lowered
+        for p in range(len(reachable)):
+            if self.matches_empty and next_reachable[p]:
+                reachable[p] = True
+                continue
+            if p < len(lowered):
+                for alternative in self.by_first_token.get(lowered[p], ()):
+                    end = p + len(alternative)
+                    if (
+                        end < len(reachable)
+                        and next_reachable[end]
+                        and tuple(lowered[p:end]) == alternative
+                    ):
+                        reachable[p] = True
+                        break
+        return reachable
+
+    def ends(self, tokens, start):
+        for alternative in self.alternatives:
+            end = start + len(alternative)
+            if tuple(tokens.lowered[start:end]) == alternative:
+                yield end
+
+
+class TokenRegex(TokenElement):
+    """
+    single token matching any of the regex patterns
+    """
+
+    def __init__(self, *patterns: str) -> None:
+        self.pattern = re.compile(f"(?:{'|'.join(patterns)})", re.IGNORECASE)
+
+    def reverse(self, tokens, next_reachable):
+        reachable = [False] * len(next_reachable)
+        for p, token in enumerate(tokens.tokens):
+            reachable[p] = next_reachable[p + 1] and bool(self.pattern.fullmatch(token))
+        return reachable
+
+    def ends(self, tokens, start):
+        if start < len(tokens) and self.pattern.fullmatch(tokens.tokens[start]):
+            yield start + 1
+
+
+class TokenAnyWords(TokenElement):
+    """
+    between min and max (inclusive) word tokens, as many as possible
+    """
+
+    def __init__(self, min=0, max=None) -> None:
+        self.min = int(min) if min != "" else 0
+        self.max = int(max) if max not in ("", None) else None
+
+    def max_end(self, tokens: Tokens, start: int) -> int:
+        run = tokens.word_runs[start]
+        if self.max is not None:
+            run = min(run, self.max)
+        return start + run
+
+    def reverse(self, tokens, next_reachable):
+        # reachable_count[i] = number of reachable positions before i
+        reachable_count = [0]
+        for r in next_reachable:
+            reachable_count.append(reachable_count[-1] + r)
+        reachable = [False] * len(next_reachable)
+        for p in range(len(reachable)):
+            lo, hi = p + self.min, self.max_end(tokens, p)
+            reachable[p] = lo <= hi and reachable_count[hi + 1] > reachable_count[lo]
+        return reachable
+
+    def ends(self, tokens, start):
+        return range(self.max_end(tokens, start), start + self.min - 1, -1)
+
+
+class TokenWildcard(TokenElement):
+    """
+    any number of tokens, as many as possible
+    """
+
+    def reverse(self, tokens, next_reachable):
+        reachable = list(next_reachable)
+        for p in range(len(reachable) - 2, -1, -1):
+            reachable[p] = reachable[p] or reachable[p + 1]
+        return reachable
+
+    def ends(self, tokens, start):
+        return range(len(tokens), start - 1, -1)
+
+
+class TokenMatcher:
+    """
+    Matches a sequence of token elements against a whole utterance
+    """
+
+    def __init__(
+        self, elements: ta.List[TokenElement], names: ta.List[ta.Optional[str]]
+    ) -> None:
+        self.elements = elements
+        self.names = names
+
+    def reachability(self, tokens: Tokens) -> ta.List[ta.List[bool]]:
+        """
+        reachable[i][p] - elements i.. match tokens p..end
+        """
+        reachable = [[False] * len(tokens) + [True]]
+        for element in reversed(self.elements):
+            reachable.append(element.reverse(tokens, reachable[-1]))
+        reachable.reverse()
+        return reachable
+
+    def fullmatch(self, user_input: str) -> bool:
+        tokens = tokens_of(user_input)
+        next_reachable = [False] * len(tokens) + [True]
+        for element in reversed(self.elements):
+            next_reachable = element.reverse(tokens, next_reachable)
+            if not any(next_reachable):
+                return False
+        return next_reachable[0]
+
+    def extract(self, user_input: str) -> ta.Optional[ta.Dict[str, str]]:
+        tokens = tokens_of(user_input)
+        reachable = self.reachability(tokens)
+        if not reachable[0][0]:
+            return None
+
+        slots = {}
+        start = 0
+        for i, element in enumerate(self.elements):
+            end = next(e for e in element.ends(tokens, start) if reachable[i + 1][e])
+            if self.names[i]:
+                slots[self.names[i]] = tokens.span_text(start, end)
+            start = end
+        return slots
@@ -0,0 +1,70 @@
+"""
+    User input analyzed once per turn
+
+    Utterance is a str so it can be used anywhere the raw input was used,
+    derived forms are computed lazily and NLU results are memoized on it
+    so components that re-check the same intent on the same input pay nothing.
+"""
+import typing as ta
+
+from agt.nlu.tokens import Tokens
+
+T = ta.TypeVar("T")
+
+
+class Utterance(str):
+    def __new__(cls, text: str) -> "Utterance":
+        utterance = super().__new__(cls, text)
+        utterance.nlu_cache = {}
+        utterance._normalized = None
+        utterance._casefolded = None
+        utterance._tokens = None
+        utterance._token_set = None
+        return utterance
+
+    def __reduce__(self):
+        return (Utterance, (str(self),))
+
+    @property
+    def normalized(self) -> str:
+        """
+        text with whitespace collapsed
+        """
+        if self._normalized is None:
+            self._normalized = " ".join(self.split())
+        return self._normalized
+
+    @property
+    def casefolded(self) -> str:
+        if self._casefolded is None:
+            self._casefolded = self.normalized.casefold()
+        return self._casefolded
+
+    @property
+    def tokens(self) -> Tokens:
+        if self._tokens is None:
+            self._tokens = Tokens(str(self))
+        return self._tokens
+
+    @property
+    def token_list(self) -> ta.List[str]:
+        """
+        lower cased words and punctuation
+        """
+        return self.tokens.lowered
+
+    @property
+    def token_set(self) -> ta.FrozenSet[str]:
+        if self._token_set is None:
+            self._token_set = frozenset(self.tokens.lowered)
+        return self._token_set
+
+    def memoize(self, key, func: ta.Callable[[str], T]) -> T:
+        """
+        func(self) computed once per key (usually the NLU object) for this utterance
+        """
+        try:
+            return self.nlu_cache[key]
+        except KeyError:
+            result = self.nlu_cache[key] = func(self)
+            return result
@@ -39,11 +39,29 @@
 """
 import typing as ta
 import abc
+import logging
+import os
 import re
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from typing import Optional
 
+from agt.nlu.regex import RegexIntent
+from agt.nlu.utterance import Utterance
+from agt.nlu.tokens import (
+    TokenAnyWords,
+    TokenElement,
+    TokenMatcher,
+    TokenRegex,
+    TokenWildcard,
+    TokenWords,
+)
+
+logger = logging.getLogger("agt")
+
+# "regex" or "tokens" (linear time matching, see agt.nlu.tokens)
+DEFAULT_BACKEND = os.environ.get("AGT_NLU_BACKEND", "regex")
+
 
 class PatternElement(abc.ABC):
     """
@@ -57,6 +75,12 @@ class PatternElement(abc.ABC):
     def regex_transformation(self):
         raise NotImplementedError
 
+    def token_transformation(self) -> TokenElement:
+        """
+        element for the tokens backend
+        """
+        raise NotImplementedError
+
 
 class RegexElement(PatternElement):
     """
@@ -70,6 +94,11 @@ class RegexElement(PatternElement):
     def regex_transformation(self):
         return self.pattern
 
+    def token_transformation(self):
+        if self.pattern in (r"(.*)", r".*"):
+            return TokenWildcard()
+        raise NotImplementedError
+
 
 class WordsRegex(PatternElement):
     """
@@ -78,11 +107,15 @@ class WordsRegex(PatternElement):
 
     def __init__(self, *patterns, **kwargs):
         super().__init__(**kwargs)
+        self.patterns = patterns
         self.word_list_tran = f"\\b({'|'.join(patterns)})\\b"
 
     def regex_transformation(self):
         return self.word_list_tran
 
+    def token_transformation(self):
+        return TokenRegex(*self.patterns)
+
 
 class Words(WordsRegex):
     """
@@ -91,8 +124,12 @@ class Words(WordsRegex):
 
     def __init__(self, *words, **kwargs):
         super().__init__(**kwargs)
+        self.words = words
         self.word_list_tran = f"\\b({'|'.join(re.escape(w) for w in words)})\\b"
 
+    def token_transformation(self):
+        return TokenWords(*self.words)
+
 
 class AnyWords(PatternElement):
     """
@@ -101,11 +138,16 @@ class AnyWords(PatternElement):
 
     def __init__(self, min="", max="", **kwargs):
         super().__init__(**kwargs)
+        self.min = min
+        self.max = max
         self.pattern = "(\\s?\\b\\w+\\b\\s?){" + f"{str(min)},{str(max)}" + "}"
 
     def regex_transformation(self):
         return self.pattern
 
+    def token_transformation(self):
+        return TokenAnyWords(self.min, self.max)
+
 
 class Wildcard(RegexElement):
     def __init__(self, **kwargs) -> None:
@@ -122,32 +164,65 @@ class Pattern:
 
     """
 
-    def __init__(self, *elements: ta.Union[PatternElement, str, tuple, list, set]):
+    def __init__(
+        self,
+        *elements: ta.Union[PatternElement, str, tuple, list, set],
+        backend: str = None,
+    ):
         elements_normalized = []
         for e in elements:
             if isinstance(e, PatternElement):
                 elements_normalized.append(e)
             elif isinstance(e, str):
                 elements_normalized.append(Words(e))
-            elif isinstance(e, (tuple, list, set)):
+            elif isinstance(e, (set, frozenset)):
+                # sorted - the same regex whatever the set iteration order (see element_key)
+                elements_normalized.append(Words(*sorted(e)))
+            elif isinstance(e, (tuple, list)):
                 elements_normalized.append(Words(*e))
 
-        self.pattern = re.compile(
-            r"\s*".join(self.wrap_element_in_group(e) for e in elements_normalized),
-            re.IGNORECASE,
+        self.elements: ta.List[PatternElement] = elements_normalized
+        self.pattern = re.compile(self.build_regex(elements_normalized), re.IGNORECASE)
+
+        self.token_matcher: Optional[TokenMatcher] = None
+        if (backend or DEFAULT_BACKEND) == "tokens":
+            try:
+                self.token_matcher = TokenMatcher(
+                    [e.token_transformation() for e in elements_normalized],
+                    [e.name for e in elements_normalized],
+                )
+            except NotImplementedError:
+                logger.warning(
+                    f"pattern {self.pattern.pattern} not supported by tokens backend, using regex"
+                )
+
+    @classmethod
+    def build_regex(
+        cls, elements: ta.List[PatternElement], named=True, name_prefix=""
+    ) -> str:
+        return r"\s*".join(
+            cls.wrap_element_in_group(e, named, name_prefix) for e in elements
         )
 
     @staticmethod
-    def wrap_element_in_group(e):
+    def wrap_element_in_group(e, named=True, name_prefix=""):
         e_name_regex = ""
-        if e.name:
-            e_name_regex = f"?P<{e.name}>"
+        if e.name and named:
+            e_name_regex = f"?P<{name_prefix}{e.name}>"
         return f"({e_name_regex}{e.regex_transformation()})"
 
+    @property
+    def slot_names(self) -> ta.List[str]:
+        return [e.name for e in self.elements if e.name]
+
     def __call__(self, user_input):
+        if self.token_matcher:
+            return self.token_matcher.fullmatch(user_input)
         return bool(self.pattern.fullmatch(user_input))
 
     def extract(self, user_input):
+        if self.token_matcher:
+            return self.token_matcher.extract(user_input) or {}
         m = self.pattern.fullmatch(user_input)
         if m:
             return m.groupdict()
@@ -155,6 +230,10 @@ class Pattern:
             return {}
 
 
+def no_preprocess(user_input: str) -> str:
+    return user_input
+
+
 class Extractor(abc.ABC):
     def __init__(
         self, *patterns: Pattern, preprocess_func: ta.Callable[[str], str] = None
@@ -163,7 +242,7 @@ class Extractor(abc.ABC):
         if preprocess_func:
             self.preprocess_func = preprocess_func
         else:
-            self.preprocess_func = lambda s: s
+            self.preprocess_func = no_preprocess
 
 
 class Intent(Extractor):
@@ -172,15 +251,39 @@ class Intent(Extractor):
     """
 
     def __call__(self, user_input) -> bool:
+        if isinstance(user_input, Utterance):
+            return user_input.memoize(self, self.match)
+        return self.match(user_input)
+
+    def match(self, user_input) -> bool:
         prepro_user_input = self.preprocess_func(user_input)
         for p in self.patterns:
             if p(prepro_user_input):
                 return True
         return False
 
+    def match_many(self, user_inputs: ta.Iterable[str]) -> ta.Iterator[bool]:
+        """
+        lazily match a stream of utterances
+        """
+        preprocess_func = self.preprocess_func
+        matchers = [
+            p.pattern.fullmatch if type(p) is Pattern and not p.token_matcher else p
+            for p in self.patterns
+        ]
+        for user_input in user_inputs:
+            prepro_user_input = preprocess_func(user_input)
+            yield any(match(prepro_user_input) for match in matchers)
+
 
 class Slots(Extractor):
     def __call__(self, user_input) -> dict:
+        if isinstance(user_input, Utterance):
+            slots = user_input.memoize(self, self.extract)
+            return {slot_name: list(values) for slot_name, values in slots.items()}
+        return self.extract(user_input)
+
+    def extract(self, user_input) -> dict:
         prepro_user_input = self.preprocess_func(user_input)
         slots = defaultdict(lambda: [])
         for p in self.patterns:
@@ -188,8 +291,26 @@ class Slots(Extractor):
                 slots[slot_name].append(slot_value)
         return dict(slots)
 
+    def extract_many(self, user_inputs: ta.Iterable[str]) -> ta.Iterator[dict]:
+        """
+        lazily extract slots from a stream of utterances
+        """
+        for user_input in user_inputs:
+            yield self(user_input)
+
 
 def extract_slot(extractor: Slots, user_input: str, slot_name: str) -> Optional[str]:
+    if isinstance(extractor, Parser):
+        return extractor.first_slot(user_input, slot_name)
+    if type(extractor) is Slots and not isinstance(user_input, Utterance):
+        # stop at the first pattern that extracts the slot
+        prepro_user_input = extractor.preprocess_func(user_input)
+        for p in extractor.patterns:
+            if slot_name in p.slot_names:
+                slots = p.extract(prepro_user_input)
+                if slot_name in slots:
+                    return slots[slot_name]
+        return None
     slot_values = extractor(user_input).get(slot_name, [])
     if len(slot_values) > 0:
         return slot_values[0]
@@ -209,3 +330,374 @@ def intent_slot(
         ta.Tuple[Intent, SlotsExtractor] -- intent and slot extractor
     """
     return Intent(*patterns, preprocess_func=preprocess_func), Slots(*patterns)
+
+
+# regex constructs that break when a pattern is merged with other patterns
+UNMERGEABLE_REGEX = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+def merge_sources(intent) -> Optional[ta.List[str]]:
+    """
+    regex alternatives (anchored like the intent matches) to merge an intent
+    with others, None if the intent has to be evaluated on its own
+    """
+    if type(intent) is RegexIntent:
+        sources = [p.pattern for p in intent.patterns]
+    elif (
+        isinstance(intent, Intent)
+        and type(intent).__call__ is Intent.__call__
+        and type(intent).match is Intent.match
+    ):
+        if any(type(p) is not Pattern or p.token_matcher for p in intent.patterns):
+            return None
+        sources = [
+            f"(?:{Pattern.build_regex(p.elements, named=False)})\\Z"
+            for p in intent.patterns
+        ]
+    else:
+        return None
+
+    if any(UNMERGEABLE_REGEX.search(s) for s in sources):
+        return None
+    return sources
+
+
+class CallableSegment:
+    def __init__(self, index: int, intent: ta.Callable[[str], bool]) -> None:
+        self.index = index
+        self.intent = intent
+
+    def match(self, user_input) -> Optional[int]:
+        return self.index if self.intent(user_input) else None
+
+    def match_all(self, user_input) -> ta.List[int]:
+        return [self.index] if self.intent(user_input) else []
+
+
+class MergedSegment:
+    """
+    consecutive intents sharing a preprocess function compiled to a single regex
+    """
+
+    def __init__(
+        self,
+        preprocess_func: ta.Callable[[str], str],
+        indexed_sources: ta.List[ta.Tuple[int, ta.List[str]]],
+    ) -> None:
+        self.preprocess_func = preprocess_func
+
+        first_alternatives = []
+        all_alternatives = []
+        self.group_index: ta.Dict[int, int] = {}
+        group = 1
+        for index, sources in indexed_sources:
+            alternatives = "|".join(f"(?:{s})" for s in sources)
+            first_alternatives.append(f"({alternatives})")
+            all_alternatives.append(f"(?:(?=({alternatives})))?")
+            self.group_index[group] = index
+            group += 1 + re.compile(alternatives).groups
+
+        self.first_matcher = re.compile("|".join(first_alternatives), re.IGNORECASE)
+        self.all_matcher = re.compile("".join(all_alternatives), re.IGNORECASE)
+
+    def match(self, user_input) -> Optional[int]:
+        m = self.first_matcher.match(self.preprocess_func(user_input))
+        if m:
+            return self.group_index[m.lastindex]
+        return None
+
+    def match_all(self, user_input) -> ta.List[int]:
+        m = self.all_matcher.match(self.preprocess_func(user_input))
+        return [index for group, index in self.group_index.items() if m.start(group) >= 0]
+
+
+class IntentSet:
+    """
+    Merge many intents into a single compiled matcher
+
+    Word pattern intents (and RegexIntent) sharing a preprocess function are compiled
+    together so the first matching intent is found in one pass over the utterance,
+    any other callable is evaluated on its own - first match order is preserved
+
+    Example:
+    intents = IntentSet(yes_intent, no_intent, Intent(Pattern(WILDCARD)))
+    intents.match("nope") -> 1
+    intents.match_all("nope") -> [1, 2]
+    """
+
+    def __init__(self, *intents: ta.Callable[[str], bool]) -> None:
+        self.intents = intents
+        self.segments: ta.List[ta.Union[CallableSegment, MergedSegment]] = []
+
+        pending: ta.List[ta.Tuple[int, ta.List[str]]] = []
+        pending_preprocess_func = None
+        for index, intent in enumerate(intents):
+            sources = merge_sources(intent)
+            preprocess_func = getattr(intent, "preprocess_func", no_preprocess)
+            if pending and (
+                sources is None or preprocess_func is not pending_preprocess_func
+            ):
+                self.add_merged_segment(pending_preprocess_func, pending)
+                pending = []
+            if sources is None:
+                self.segments.append(CallableSegment(index, intent))
+            elif sources:
+                pending.append((index, sources))
+                pending_preprocess_func = preprocess_func
+        if pending:
+            self.add_merged_segment(pending_preprocess_func, pending)
+
+    def add_merged_segment(self, preprocess_func, indexed_sources):
+        try:
+            self.segments.append(MergedSegment(preprocess_func, indexed_sources))
+        except re.error:
+            # fallback to evaluating one by one
+            for index, _ in indexed_sources:
+                self.segments.append(CallableSegment(index, self.intents[index]))
+
+    def match(self, user_input) -> Optional[int]:
+        """
+        index of the first matching intent, None if nothing matched
+        """
+        if isinstance(user_input, Utterance):
+            return user_input.memoize((self, "match"), self.match_text)
+        return self.match_text(user_input)
+
+    def match_text(self, user_input) -> Optional[int]:
+        for segment in self.segments:
+            index = segment.match(user_input)
+            if index is not None:
+                return index
+        return None
+
+    def match_all(self, user_input) -> ta.List[int]:
+        """
+        indexes of all matching intents in order
+        """
+        if isinstance(user_input, Utterance):
+            return list(user_input.memoize((self, "match_all"), self.match_all_text))
+        return self.match_all_text(user_input)
+
+    def match_all_text(self, user_input) -> ta.List[int]:
+        matches = []
+        for segment in self.segments:
+            matches.extend(segment.match_all(user_input))
+        return matches
+
+    def first(self, user_input) -> Optional[ta.Callable[[str], bool]]:
+        index = self.match(user_input)
+        if index is not None:
+            return self.intents[index]
+        return None
+
+    def __call__(self, user_input) -> bool:
+        return self.match(user_input) is not None
+
+    def __len__(self) -> int:
+        return len(self.intents)
+
+
+class Parser(Extractor):
+    """
+    Intent classification and slot extraction from a single match
+
+    Example:
+    parser = Parser(
+        Pattern("i", "want", AnyWords(min=1, max=3, name="thing")),
+        Pattern(WILDCARD, "buy", AnyWords(min=1, max=3, name="thing")),
+    )
+    parser("i want a bike") -> (0, {"thing": ["a bike"]})
+    parser("hello") -> None
+    parser.first_slot("lets buy a car", "thing") -> "a car"
+    """
+
+    def __init__(
+        self, *patterns: Pattern, preprocess_func: ta.Callable[[str], str] = None
+    ) -> None:
+        super().__init__(*patterns, preprocess_func=preprocess_func)
+        self.slot_patterns: ta.Dict[str, ta.List[Pattern]] = defaultdict(list)
+        for p in patterns:
+            for slot_name in p.slot_names:
+                self.slot_patterns[slot_name].append(p)
+
+        self.first_matcher = None
+        if all(type(p) is Pattern and not p.token_matcher for p in patterns):
+            try:
+                self.compile_first_matcher()
+            except re.error:
+                self.first_matcher = None
+
+    def compile_first_matcher(self) -> None:
+        # all patterns in one alternation, slot groups renamed to p<index>_<name>
+        alternatives = []
+        self.group_index: ta.Dict[int, int] = {}
+        group = 1
+        for index, p in enumerate(self.patterns):
+            source = p.build_regex(p.elements, name_prefix=f"p{index}_")
+            if UNMERGEABLE_REGEX.search(source):
+                raise re.error("pattern can not be merged")
+            alternatives.append(f"((?:{source})\\Z)")
+            self.group_index[group] = index
+            group += 1 + re.compile(source).groups
+        self.first_matcher = re.compile("|".join(alternatives), re.IGNORECASE)
+
+    def __call__(
+        self, user_input, first_match=False
+    ) -> Optional[ta.Tuple[int, ta.Dict[str, ta.List[str]]]]:
+        """
+        Returns:
+            (index of the first matching pattern, slots) or None if nothing matched,
+            slots are collected from all matching patterns like Slots
+            or only from the first matching pattern if first_match
+        """
+        if isinstance(user_input, Utterance):
+            parsed = user_input.memoize(
+                (self, first_match), lambda u: self.parse(u, first_match)
+            )
+            if parsed is None:
+                return None
+            index, slots = parsed
+            return index, {slot_name: list(values) for slot_name, values in slots.items()}
+        return self.parse(user_input, first_match)
+
+    def parse(
+        self, user_input, first_match=False
+    ) -> Optional[ta.Tuple[int, ta.Dict[str, ta.List[str]]]]:
+        prepro_user_input = self.preprocess_func(user_input)
+        if first_match and self.first_matcher:
+            m = self.first_matcher.match(prepro_user_input)
+            if not m:
+                return None
+            index = self.group_index[m.lastindex]
+            return (
+                index,
+                {
+                    slot_name: [m.group(f"p{index}_{slot_name}")]
+                    for slot_name in self.patterns[index].slot_names
+                },
+            )
+
+        matched_index = None
+        slots: ta.Dict[str, ta.List[str]] = defaultdict(list)
+        for index, p in enumerate(self.patterns):
+            if p.slot_names:
+                extracted = p.extract(prepro_user_input)
+                matched = bool(extracted)
+            else:
+                extracted = {}
+                matched = p(prepro_user_input)
+            if matched:
+                if matched_index is None:
+                    matched_index = index
+                for slot_name, slot_value in extracted.items():
+                    slots[slot_name].append(slot_value)
+                if first_match:
+                    break
+        if matched_index is None:
+            return None
+        return matched_index, dict(slots)
+
+    def first_slot(self, user_input, slot_name: str) -> Optional[str]:
+        """
+        slot value from the first matching pattern that has the slot
+        """
+        prepro_user_input = self.preprocess_func(user_input)
+        for p in self.slot_patterns.get(slot_name, []):
+            slots = p.extract(prepro_user_input)
+            if slot_name in slots:
+                return slots[slot_name]
+        return None
+
+
+INTERN_CACHE_SIZE = int(os.environ.get("AGT_INTERN_CACHE_SIZE", 1024))
+
+
+class InternCache:
+    """
+    Bounded LRU cache of compiled objects with hit/miss/eviction counters
+    """
+
+    def __init__(self, maxsize: int = INTERN_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_create(self, key, factory: ta.Callable[[], ta.Any]):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = factory()
+            self.entries[key] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return value
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+patterns_cache = InternCache()
+intents_cache = InternCache()
+
+
+def element_key(e) -> tuple:
+    if isinstance(e, PatternElement):
+        return (type(e), e.regex_transformation(), e.name)
+    elif isinstance(e, str):
+        return (str, e)
+    elif isinstance(e, (set, frozenset)):
+        return (set, tuple(sorted(e)))
+    elif isinstance(e, (tuple, list)):
+        return (tuple, tuple(e))
+    # ignored by Pattern
+    return (None,)
+
+
+def intern_pattern(
+    *elements: ta.Union[PatternElement, str, tuple, list, set], backend: str = None
+) -> Pattern:
+    """
+    same as Pattern(*elements) but returns the same compiled Pattern for the same elements
+
+    Example:
+    intern_pattern(WILDCARD, ["vanilla"], WILDCARD) is intern_pattern(WILDCARD, ("vanilla",), WILDCARD) -> True
+    """
+    backend = backend or DEFAULT_BACKEND
+    key = (backend,) + tuple(element_key(e) for e in elements)
+    return patterns_cache.get_or_create(
+        key, lambda: Pattern(*elements, backend=backend)
+    )
+
+
+def intern_intent(
+    *elements: ta.Union[PatternElement, str, tuple, list, set], backend: str = None
+) -> Intent:
+    """
+    same as Intent(Pattern(*elements)) but returns the same Intent for the same elements
+    """
+    backend = backend or DEFAULT_BACKEND
+    key = (backend,) + tuple(element_key(e) for e in elements)
+    return intents_cache.get_or_create(
+        key, lambda: Intent(intern_pattern(*elements, backend=backend))
+    )
+
+
+def intern_cache_stats() -> dict:
+    return {"patterns": patterns_cache.stats(), "intents": intents_cache.stats()}
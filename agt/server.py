@@ -1,29 +1,179 @@
 import asyncio
+import logging
+import os
+import time
+import typing as ta
 
-from .state import ConversationState, OutOfContext, Message
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .hibernation import SessionSnapshot, SessionStore, session_store_from_url
+from .state import ConversationState, OutOfContext, BotEntry, StateHooks
+
+logger = logging.getLogger("agt")
+
+# sessions with more recorded turns are too long to replay, they are evicted without hibernating
+MAX_RECORDED_TURNS = int(os.environ.get("AGT_HIBERNATE_MAX_TURNS", 1000))
 
 
 class BotSessionContainer:
-    def __init__(self, bot_coro, async_output_callback=None):
+    def __init__(
+        self,
+        bot_coro,
+        async_output_callback=None,
+        hooks: Optional[StateHooks] = None,
+        snapshot_loader: Optional[ta.Awaitable[Optional[SessionSnapshot]]] = None,
+    ):
         event_loop = asyncio.get_event_loop()
         self.responses = []
+        # streams responses instead of collecting them while set
+        self.response_callback: Optional[ta.Callable[[BotEntry], ta.Awaitable]] = None
         self.conv_state = ConversationState(async_output_callback or self.add_response)
+        self.conv_state.hooks = hooks
         self.conv_state.set_out_of_context_handler(self.default_out_of_context_handler)
-        self.bot_task: asyncio.Task = event_loop.create_task(bot_coro(self.conv_state))
+        self.conv_state.wait_for_input_callback = self.complete_turn
+        # the bot starts after the hibernated session (if any) is loaded and set up for replay
+        self.restoring: Optional[asyncio.Future] = None
+        if snapshot_loader is not None:
+            self.restoring = asyncio.ensure_future(self.load_snapshot(snapshot_loader))
+            bot_run = self.run_restored(bot_coro)
+        else:
+            bot_run = bot_coro(self.conv_state)
+        self.bot_task: asyncio.Task = event_loop.create_task(bot_run)
+        self.bot_task.add_done_callback(self.complete_turn)
+        # the bot finished, failed or was evicted - write the spilled log entries still buffered
+        self.bot_task.add_done_callback(self.flush_log)
 
         self.out_of_context_event = asyncio.Event()
-        self.out_of_context_input_event = asyncio.Event()
+        # resolved by the next user input while the bot waits in the default out of context handler
+        self.out_of_context_resume: Optional[asyncio.Future] = None
+
+        # resolved when the bot asks for input, finishes or goes out of context
+        self.turn_done: Optional[asyncio.Future] = None
+        # perf_counter at the user input of the current turn, for the turn_end hook
+        self.turn_started_at: Optional[float] = None
+
+        # (context update, user input) per turn, kept for hibernation
+        self.record_turns = False
+        self.turns: ta.List[ta.Tuple[dict, str]] = []
+        self.restored_memory: Optional[dict] = None
+
+    def restore(self, snapshot: SessionSnapshot):
+        """
+        rebuild the session by replaying the snapshot turns before the next input
+        """
+        self.conv_state.session_id = snapshot.session_id
+        self.conv_state.start_replay(snapshot.turns)
+        self.turns = list(snapshot.turns)
+        self.restored_memory = snapshot.memory
+
+    async def load_snapshot(self, snapshot_loader):
+        snapshot = await snapshot_loader
+        if snapshot:
+            self.restore(snapshot)
+
+    async def run_restored(self, bot_coro):
+        # shielded - an exchange may be waiting for the restore as well
+        await asyncio.shield(self.restoring)
+        return await bot_coro(self.conv_state)
+
+    def snapshot(self) -> SessionSnapshot:
+        # copies - saved from the store thread
+        return SessionSnapshot(
+            self.conv_state.session_id, dict(self.conv_state.memory), list(self.turns)
+        )
+
+    def begin_turn(self) -> asyncio.Future:
+        """
+        new turn completion future - a plain future, no task is created to wait for the bot
+        """
+        self.turn_done = asyncio.get_event_loop().create_future()
+        if self.bot_task.done():
+            self.turn_done.set_result(None)
+        return self.turn_done
+
+    def flush_log(self, *args) -> None:
+        self.conv_state.log.flush()
+
+    @property
+    def in_turn(self) -> bool:
+        """
+        an exchange is waiting for the bot to finish the current turn (or for the session to load)
+        """
+        if self.restoring is not None and not self.restoring.done():
+            return True
+        return self.turn_done is not None and not self.turn_done.done()
+
+    def complete_turn(self, *args) -> None:
+        if self.turn_done is not None and not self.turn_done.done():
+            self.turn_done.set_result(None)
+            hooks = self.conv_state.hooks
+            if hooks is not None and self.turn_started_at is not None:
+                hooks.turn_end(self.conv_state, time.perf_counter() - self.turn_started_at)
+                self.turn_started_at = None
+
+    async def wait_replayed(self):
+        await self.begin_turn()
+        self.out_of_context_event.clear()
+        self.conv_state.stop_replay(self.restored_memory)
+        self.restored_memory = None
+
+    async def user_turn(self, user_input: str, context: Optional[dict] = None):
+        """
+        deliver the next user input with its context update,
+        self.turn_done resolves when the bot is done with it
+        """
+        if self.restoring is not None:
+            await self.restoring
+        if self.conv_state.replaying:
+            await self.wait_replayed()
+
+        self.begin_turn()
+        if self.conv_state.hooks is not None and not self.turn_done.done():
+            self.turn_started_at = time.perf_counter()
+            self.conv_state.hooks.turn_start(self.conv_state)
+        if self.out_of_context_resume is not None and not self.out_of_context_resume.done():
+            self.out_of_context_resume.set_result(None)
+
+        context = context or {}
+        self.conv_state.memory.update(context)
+        if self.record_turns:
+            if len(self.turns) < MAX_RECORDED_TURNS:
+                self.turns.append((context, user_input))
+            else:
+                # too long to replay - dropped when evicted
+                self.record_turns = False
+                self.turns = []
+        await self.conv_state.put_user_input(user_input)
+
+    async def exchange_turn(self, user_input: str, context: Optional[dict] = None):
+        """
+        deliver the next user input and wait until the bot asks for input, finishes or goes out of context
+        """
+        await self.user_turn(user_input, context)
+        await self.turn_done
 
     async def default_out_of_context_handler(self, state, user_input=None):
+        if state.replay_turns:
+            # replayed turn - the next recorded input resumes the bot
+            return
         self.out_of_context_event.set()
-        await self.out_of_context_input_event.wait()
-        self.out_of_context_input_event.clear()
+        self.out_of_context_resume = asyncio.get_event_loop().create_future()
+        self.complete_turn()
+        try:
+            await self.out_of_context_resume
+        finally:
+            self.out_of_context_resume = None
 
     async def wait_for_out_of_context(self):
         await self.out_of_context_event.wait()
 
-    async def add_response(self, message: Message, *args, **kwargs):
-        self.responses.append(message)
+    async def add_response(self, message: BotEntry, *args, **kwargs):
+        if self.response_callback:
+            await self.response_callback(message)
+        else:
+            self.responses.append(message)
 
     def collect_responses(self):
         response = " ".join(self.responses)
@@ -34,9 +184,50 @@ class BotSessionContainer:
         self.responses = []
 
 
+def new_store_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(1, thread_name_prefix="agt-session-store")
+
+
+def env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
 class AgentSessionsManager:
-    def __init__(self):
-        self.sessions = {}
+    """
+    Sessions by session id
+
+    Idle sessions are evicted (and their bot task cancelled) after session_ttl seconds
+    and the least recently used sessions are evicted when there are more than max_sessions.
+    both default to AGT_SESSION_TTL / AGT_MAX_SESSIONS environment variables (no eviction if unset)
+
+    With a session_store (or AGT_SESSION_STORE=sqlite:<path> / file:<directory>) evicted sessions
+    are hibernated to the store and rebuilt on their next input (see agt.hibernation),
+    the store is used from a single thread, in order, off the event loop
+    """
+
+    def __init__(
+        self,
+        session_ttl: Optional[float] = None,
+        max_sessions: Optional[int] = None,
+        session_store: Optional[SessionStore] = None,
+    ):
+        # least recently used first
+        self.sessions: "OrderedDict[ta.Any, BotSessionContainer]" = OrderedDict()
+        self.last_active: ta.Dict[ta.Any, float] = {}
+        self.session_ttl = session_ttl or env_float("AGT_SESSION_TTL")
+        self.max_sessions = max_sessions or int(env_float("AGT_MAX_SESSIONS") or 0) or None
+        self.session_store = session_store
+        if not session_store and os.environ.get("AGT_SESSION_STORE"):
+            self.session_store = session_store_from_url(os.environ["AGT_SESSION_STORE"])
+        self.store_executor: Optional[ThreadPoolExecutor] = None
+        if self.session_store:
+            self.store_executor = new_store_executor()
+        self.expiry_timer: Optional[asyncio.TimerHandle] = None
+        self.ttl_evictions = 0
+        self.capacity_evictions = 0
+        self.hibernated = 0
+        self.restored = 0
 
     def session_cleanup_builder(self, bot, session_id):
         async def bot_coro(s):
@@ -46,19 +237,142 @@ class AgentSessionsManager:
             except Exception as e:
                 raise e
             finally:
-                self.sessions.pop(session_id, None)
+                sc = self.sessions.get(session_id)
+                if sc is not None and sc.conv_state is s:
+                    self.remove_session(session_id)
             return res
 
         return bot_coro
 
     def get_session(
-        self, session_id, bot, async_output_callback=None
+        self, session_id, bot, async_output_callback=None, hooks: Optional[StateHooks] = None
     ) -> BotSessionContainer:
         sc = self.sessions.get(session_id)
-        if not sc or (sc.bot_task.done() and sc.bot_task.exception()):
+        if not sc or (
+            sc.bot_task.done()
+            and (sc.bot_task.cancelled() or sc.bot_task.exception())
+        ):
+            if sc:
+                self.remove_session(session_id)
             sc = BotSessionContainer(
                 self.session_cleanup_builder(bot, session_id),
                 async_output_callback=async_output_callback,
+                hooks=hooks,
+                snapshot_loader=self.load_snapshot(session_id) if self.session_store else None,
             )
+            sc.record_turns = self.session_store is not None
             self.sessions[session_id] = sc
+        else:
+            self.sessions.move_to_end(session_id)
+        self.last_active[session_id] = asyncio.get_event_loop().time()
+
+        while self.max_sessions and len(self.sessions) > self.max_sessions:
+            # sessions in the middle of a turn are skipped, over capacity until they are done
+            idle_session_id = next(
+                (
+                    sid
+                    for sid, s in self.sessions.items()
+                    if sid != session_id and not s.in_turn
+                ),
+                None,
+            )
+            if idle_session_id is None:
+                break
+            self.evict_session(idle_session_id)
+            self.capacity_evictions += 1
+
+        if self.session_ttl and not self.expiry_timer:
+            self.schedule_expiry()
         return sc
+
+    def remove_session(self, session_id) -> Optional[BotSessionContainer]:
+        self.last_active.pop(session_id, None)
+        return self.sessions.pop(session_id, None)
+
+    def evict_session(self, session_id) -> None:
+        sc = self.remove_session(session_id)
+        if sc and not sc.bot_task.done():
+            if self.session_store and sc.record_turns:
+                self.hibernate(session_id, sc)
+            # now - the cancelled task may never run again (e.g. hibernate_all on shutdown)
+            sc.flush_log()
+            sc.bot_task.cancel()
+
+    def after_fork(self) -> None:
+        """
+        reopen the store thread and connections in a forked worker process
+        """
+        if self.session_store:
+            self.store_executor = new_store_executor()
+            self.session_store.reopen()
+
+    def run_in_store_executor(self, func, *args) -> asyncio.Future:
+        return asyncio.get_event_loop().run_in_executor(self.store_executor, func, *args)
+
+    async def load_snapshot(self, session_id) -> Optional[SessionSnapshot]:
+        try:
+            snapshot = await self.run_in_store_executor(self.session_store.load, str(session_id))
+            if snapshot:
+                await self.run_in_store_executor(self.session_store.delete, str(session_id))
+                self.restored += 1
+            return snapshot
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    def save_snapshot(self, key: str, snapshot: SessionSnapshot) -> None:
+        try:
+            self.session_store.save(key, snapshot)
+            self.hibernated += 1
+        except Exception as e:
+            logger.exception(e)
+
+    def hibernate(self, session_id, sc: BotSessionContainer) -> None:
+        # saved after the loads and saves before it (single store thread)
+        self.run_in_store_executor(self.save_snapshot, str(session_id), sc.snapshot())
+
+    async def hibernate_all(self) -> None:
+        """
+        hibernate all live sessions (e.g. before shutdown)
+        """
+        while self.sessions:
+            self.evict_session(next(iter(self.sessions)))
+        if self.store_executor:
+            # wait for the pending saves
+            await self.run_in_store_executor(lambda: None)
+
+    def schedule_expiry(self) -> None:
+        """
+        single timer for the least recently used session - no per session tasks
+        """
+        self.expiry_timer = None
+        if not self.sessions:
+            return
+        oldest_session_id = next(iter(self.sessions))
+        self.expiry_timer = asyncio.get_event_loop().call_at(
+            self.last_active[oldest_session_id] + self.session_ttl, self.expire_sessions
+        )
+
+    def expire_sessions(self) -> None:
+        now = asyncio.get_event_loop().time()
+        while self.sessions:
+            oldest_session_id = next(iter(self.sessions))
+            if self.last_active[oldest_session_id] + self.session_ttl > now:
+                break
+            if self.sessions[oldest_session_id].in_turn:
+                # still busy with a turn - not idle
+                self.sessions.move_to_end(oldest_session_id)
+                self.last_active[oldest_session_id] = now
+                continue
+            self.evict_session(oldest_session_id)
+            self.ttl_evictions += 1
+        self.schedule_expiry()
+
+    def stats(self) -> dict:
+        return {
+            "active_sessions": len(self.sessions),
+            "ttl_evictions": self.ttl_evictions,
+            "capacity_evictions": self.capacity_evictions,
+            "hibernated": self.hibernated,
+            "restored": self.restored,
+        }
@@ -0,0 +1,305 @@
+"""
+    Multi process serving with session affinity
+
+    agt serve --workers N loads the component, then forks N workers (sharing the loaded
+    blueprints and compiled intents copy-on-write), each serving AgentCoCoApp on a local port.
+    A front router on the public port sends each exchange to the worker owning its session_id
+    on a consistent hash ring, so a session always lives in one worker.
+    Batches are split by worker and merged back in order.
+    The router runs in a forked process as well, the parent restarts workers that die (on the same
+    port, so the ring doesn't change - the sessions they held are lost unless hibernated) and stops
+    everything when the router exits. Requests to a worker that is down get a 503.
+"""
+import asyncio
+import bisect
+import gc
+import hashlib
+import logging
+import os
+import re
+import signal
+import sys
+import time
+import typing as ta
+
+from json import dumps
+
+import httpx
+from sanic import Sanic
+from sanic.response import json, raw
+
+logger = logging.getLogger("agt")
+
+SESSION_PATH_REGEX = re.compile(r"^/(?:api/)?exchange(?:_stream)?/[^/]+/(?P<session_id>[^/]+)")
+
+# headers passed between the front router and the workers
+FORWARDED_REQUEST_HEADERS = ("content-type", "accept", "accept-encoding")
+FORWARDED_RESPONSE_HEADERS = ("content-type", "content-encoding", "etag", "server-timing")
+
+# seconds - a worker dying sooner after its start is restarted only after this delay
+RESTART_DELAY = 1.0
+
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring - adding or removing a node only moves the keys of that node
+    """
+
+    def __init__(self, nodes: ta.Iterable[ta.Any] = (), replicas: int = 64) -> None:
+        self.replicas = replicas
+        self.points: ta.List[int] = []
+        self.point_nodes: ta.List[ta.Any] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node) -> None:
+        for replica in range(self.replicas):
+            point = hash_key(f"{node}#{replica}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.point_nodes.insert(index, node)
+
+    def remove(self, node) -> None:
+        kept = [(p, n) for p, n in zip(self.points, self.point_nodes) if n != node]
+        self.points = [p for p, _ in kept]
+        self.point_nodes = [n for _, n in kept]
+
+    def node_for(self, key: str):
+        if not self.points:
+            raise LookupError("Empty hash ring")
+        index = bisect.bisect(self.points, hash_key(key)) % len(self.points)
+        return self.point_nodes[index]
+
+
+def session_id_from_path(path: str) -> ta.Optional[str]:
+    m = SESSION_PATH_REGEX.match(path)
+    return m.group("session_id") if m else None
+
+
+def fork_process(run: ta.Callable[[], None]) -> int:
+    """
+    run in a forked process, returns its pid
+    """
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            run()
+            code = 0
+        except Exception:
+            logger.exception("agt forked process failed")
+        finally:
+            os._exit(code)
+    return pid
+
+
+def fork_worker(agent_app, host: str, port: int) -> int:
+    def run_worker():
+        # connections and threads of the parent can't be used in the worker
+        agent_app.after_fork()
+        # single process - sanic's worker manager would serve from a fresh interpreter instead
+        agent_app.run(host=host, port=port, single_process=True)
+
+    return fork_process(run_worker)
+
+
+def fork_workers(agent_app, workers: int, host: str, base_port: int) -> ta.List[int]:
+    """
+    fork a worker process per port, returns their pids
+    """
+    # objects loaded so far are shared with the workers, keep the gc from touching (and copying) them
+    gc.freeze()
+
+    return [fork_worker(agent_app, host, base_port + i) for i in range(workers)]
+
+
+def stop_workers(pids: ta.List[int]) -> None:
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+def supervise_workers(
+    agent_app, worker_ports: ta.List[int], pids: ta.List[int], router_pid: int
+) -> None:
+    """
+    restart workers as they exit until the router exits, pids are updated in place
+    """
+    started_at = [time.monotonic()] * len(pids)
+    while True:
+        pid, status = os.wait()
+        if pid == router_pid:
+            logger.info(f"agt router exited with status {status}")
+            return
+        if pid not in pids:
+            continue
+        i = pids.index(pid)
+        logger.error(f"agt worker {pid} on port {worker_ports[i]} exited with status {status}")
+        if time.monotonic() - started_at[i] < RESTART_DELAY:
+            time.sleep(RESTART_DELAY)
+        pids[i] = fork_worker(agent_app, "127.0.0.1", worker_ports[i])
+        started_at[i] = time.monotonic()
+        logger.info(f"agt worker {pids[i]} restarted on port {worker_ports[i]}")
+
+
+class ShardRouter:
+    """
+    Front router app forwarding requests to the worker owning their session
+    """
+
+    def __init__(self, worker_urls: ta.List[str], batch_max_items: ta.Optional[int] = None) -> None:
+        self.worker_urls = worker_urls
+        self.batch_max_items = batch_max_items
+        self.ring = HashRing(range(len(worker_urls)))
+        self.sanic_app = Sanic("agt_shard_router")
+        self.http_client = httpx.AsyncClient(
+            timeout=None,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+        )
+        self.sanic_app.add_route(
+            self.exchange_batch, "/api/exchange_batch", methods=["POST"]
+        )
+        self.sanic_app.add_route(self.exchange_batch, "/exchange_batch", methods=["POST"])
+        self.sanic_app.add_route(self.forward, "/<path:path>", methods=["GET", "POST"])
+
+    def worker_url(self, session_id: ta.Optional[str]) -> str:
+        if session_id is None:
+            return self.worker_urls[0]
+        return self.worker_urls[self.ring.node_for(session_id)]
+
+    @staticmethod
+    def worker_unavailable(worker_url: str, e: Exception):
+        logger.error(f"agt worker {worker_url} unavailable: {e}")
+        return json(
+            {"error": "Worker unavailable"}, status=503, headers={"Retry-After": "1"}
+        )
+
+    async def forward(self, request, path):
+        worker_url = self.worker_url(session_id_from_path(request.path))
+        url = worker_url + request.path
+        if request.query_string:
+            url += "?" + request.query_string
+        headers = {
+            name: request.headers[name]
+            for name in FORWARDED_REQUEST_HEADERS
+            if name in request.headers
+        }
+
+        try:
+            upstream = await self.http_client.send(
+                self.http_client.build_request(
+                    request.method, url, content=request.body, headers=headers
+                ),
+                stream=True,
+            )
+        except httpx.ConnectError as e:
+            return self.worker_unavailable(worker_url, e)
+
+        try:
+            response = await request.respond(
+                status=upstream.status_code,
+                headers={
+                    name: upstream.headers[name]
+                    for name in FORWARDED_RESPONSE_HEADERS
+                    if name in upstream.headers
+                },
+            )
+            # passed through as is - streamed exchanges keep flushing per message
+            async for chunk in upstream.aiter_raw():
+                await response.send(chunk)
+            await response.eof()
+        finally:
+            await upstream.aclose()
+
+    async def exchange_batch(self, request):
+        items = request.json
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list):
+            return json({"error": "Expected a list of exchange items"}, status=400)
+        if self.batch_max_items and len(items) > self.batch_max_items:
+            return json(
+                {"error": f"Batch of {len(items)} items, max is {self.batch_max_items}"},
+                status=400,
+            )
+
+        indexes_by_worker: ta.Dict[str, ta.List[int]] = {}
+        for i, item in enumerate(items):
+            session_id = item.get("session_id") if isinstance(item, dict) else None
+            worker_url = self.worker_url(None if session_id is None else str(session_id))
+            indexes_by_worker.setdefault(worker_url, []).append(i)
+
+        if len(indexes_by_worker) == 1:
+            worker_url = next(iter(indexes_by_worker))
+            try:
+                rv = await self.http_client.post(
+                    worker_url + "/api/exchange_batch",
+                    content=request.body,
+                    headers={"content-type": "application/json"},
+                )
+            except httpx.ConnectError as e:
+                return self.worker_unavailable(worker_url, e)
+            return raw(rv.content, status=rv.status_code, content_type="application/json")
+
+        async def worker_batch(worker_url, indexes):
+            rv = await self.http_client.post(
+                worker_url + "/api/exchange_batch", json=[items[i] for i in indexes]
+            )
+            return rv.status_code, rv.json()
+
+        try:
+            responses = await asyncio.gather(
+                *[
+                    worker_batch(worker_url, indexes)
+                    for worker_url, indexes in indexes_by_worker.items()
+                ]
+            )
+        except httpx.ConnectError as e:
+            return self.worker_unavailable(str(e.request.url), e)
+
+        results: list = [None] * len(items)
+        for indexes, (status, response) in zip(indexes_by_worker.values(), responses):
+            if status != 200:
+                return json(response, status=status)
+            for i, result in zip(indexes, response["results"]):
+                results[i] = result
+        return raw(dumps({"results": results}), content_type="application/json")
+
+    def run(self, *args, **kwargs):
+        self.sanic_app.run(*args, **kwargs)
+
+
+def serve_sharded(agent_app, workers: int, host: str = "0.0.0.0", port: int = 8080) -> None:
+    """
+    serve agent_app (with its blueprints already added) on port with workers processes,
+    workers listen on localhost ports port+1 .. port+workers
+    """
+    worker_ports = [port + 1 + i for i in range(workers)]
+    pids = fork_workers(agent_app, workers, "127.0.0.1", worker_ports[0])
+    logger.info(f"agt workers {pids} on ports {worker_ports}")
+
+    def run_router():
+        router = ShardRouter(
+            [f"http://127.0.0.1:{p}" for p in worker_ports],
+            batch_max_items=agent_app.batch_max_items,
+        )
+        router.run(host=host, port=port, single_process=True)
+
+    router_pid = fork_process(run_router)
+    # stop the workers on SIGTERM as well (the router gets its own)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        supervise_workers(agent_app, worker_ports, pids, router_pid)
+    finally:
+        stop_workers(pids + [router_pid])
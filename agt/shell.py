@@ -9,7 +9,7 @@ from typing import Optional
 from dotenv import load_dotenv, find_dotenv
 from aioconsole import ainput
 
-from .state import ConversationState, Message
+from .state import BotEntry, ConversationState
 
 load_dotenv(find_dotenv(usecwd=True))
 
@@ -23,7 +23,7 @@ async def input_loop(s) -> None:
         await s.put_user_input(await ainput())
 
 
-async def console_output(message: Message, *args, **kwargs):
+async def console_output(message: BotEntry, *args, **kwargs):
     print(f"Bot: {message.text}")
 
 
@@ -91,6 +91,159 @@ def deploy(
     asyncio.run(agt_deploy(str(config), app_name=shell_app.info.name or "agt"))
 
 
+@shell_app.command("nlu-eval")
+def nlu_eval(
+    intents: str = typer.Argument(
+        ...,
+        help="dict of intents by name or a single intent - format is module:intents_name",
+    ),
+    corpus: pathlib.Path = typer.Argument(
+        ..., help="JSONL or CSV (with header) file of utterances"
+    ),
+    text_field: str = typer.Option("text", help="utterance field in the corpus"),
+    label_field: str = typer.Option(
+        "label", help="expected intent name field in the corpus (optional)"
+    ),
+    workers: int = typer.Option(1, "--workers", "-w", help="number of processes"),
+    chunk_size: int = typer.Option(1000, help="utterances per worker task"),
+    output: Optional[pathlib.Path] = typer.Option(
+        None, help="write the report as json to this file"
+    ),
+):
+    """
+    Evaluate intents over a corpus of utterances - hits per intent, confusion matrix and throughput
+    """
+    from agt.nlu.evaluate import evaluate_corpus, read_corpus
+
+    report = evaluate_corpus(
+        intents,
+        read_corpus(str(corpus), text_field=text_field, label_field=label_field),
+        workers=workers,
+        chunk_size=chunk_size,
+    )
+    typer.echo(report.format())
+    if output:
+        with open(output, "w") as f:
+            json.dump(report.dict(), f, indent=True)
+
+
+@shell_app.command("coco-emulator")
+def coco_emulator(
+    emulator: str = typer.Argument(
+        ..., help="agt.testing.CoCoEmulator instance - format is module:emulator_name"
+    ),
+    host: str = typer.Option("127.0.0.1", help="host to listen on"),
+    port: int = typer.Option(9000, "--port", "-p", help="port to listen on"),
+):
+    """
+    Serve scripted remote components offline - point bots at it with COCOHUB_URL=http://<host>:<port>
+    """
+    import importlib
+    import sys
+
+    sys.path.append(".")
+
+    module_path, emulator_name = emulator.rsplit(":", maxsplit=1)
+    emulator_obj = getattr(importlib.import_module(module_path), emulator_name)
+
+    typer.echo(f"CoCo emulator on http://{host}:{port}")
+    asyncio.run(emulator_obj.serve_forever(host=host, port=port))
+
+
+@shell_app.command()
+def bench(
+    component: Optional[str] = typer.Argument(
+        None,
+        help="component to serve and benchmark - format is module:agt_comp_name (or use --url)",
+    ),
+    url: Optional[str] = typer.Option(
+        None, help="benchmark an already served component at this url"
+    ),
+    blueprint_id: Optional[str] = typer.Option(
+        None, "--blueprint-id", help="blueprint to exchange with (default - the component name)"
+    ),
+    script: Optional[pathlib.Path] = typer.Option(
+        None,
+        help="json list of conversations, each a list of user inputs (or exchange requests)",
+    ),
+    sessions: int = typer.Option(1000, help="sessions to run"),
+    concurrency: int = typer.Option(
+        50, "--concurrency", "-c", help="concurrent sessions (closed model) / max connections"
+    ),
+    rate: Optional[float] = typer.Option(
+        None, help="open model - new sessions per second regardless of server speed"
+    ),
+    duration: Optional[float] = typer.Option(
+        None, help="run for this many seconds instead of --sessions"
+    ),
+    server_pid: Optional[int] = typer.Option(
+        None,
+        help="pid of the process serving --url to sample memory of (the sanic worker, not its manager)",
+    ),
+    output: Optional[pathlib.Path] = typer.Option(
+        None, help="write the results as json to this file"
+    ),
+    baseline: Optional[pathlib.Path] = typer.Option(
+        None, help="compare with the json results of a previous run"
+    ),
+    threshold: float = typer.Option(
+        0.1, help="relative change flagged as a regression when comparing"
+    ),
+):
+    """
+    Load test a served component through /api/exchange - throughput, latency percentiles, errors and memory growth
+    """
+    from agt.testing.loadgen import (
+        BENCH_METRICS,
+        LoadGenerator,
+        ServedComponent,
+        format_results,
+        load_script,
+    )
+    from agt.testing.results import compare_results, format_comparison, load_results, save_results
+
+    if not component and not url:
+        raise typer.BadParameter("Either a component or --url is required")
+
+    served = None
+    if not url:
+        served = ServedComponent(component)
+        served.start()
+        url = served.url
+        server_pid = served.process.pid
+    blueprint_id = blueprint_id or (component.rsplit(":", maxsplit=1)[-1] if component else None)
+    if not blueprint_id:
+        raise typer.BadParameter("--blueprint-id is required with --url")
+
+    try:
+        results = asyncio.run(
+            LoadGenerator(
+                url,
+                blueprint_id,
+                load_script(str(script) if script else None),
+                sessions=sessions,
+                concurrency=concurrency,
+                rate=rate,
+                duration=duration,
+                server_pid=server_pid,
+            ).run()
+        )
+    finally:
+        if served:
+            served.stop()
+
+    typer.echo(format_results(results))
+    if output:
+        save_results(results, str(output))
+    if baseline:
+        comparisons = compare_results(
+            results, load_results(str(baseline)), BENCH_METRICS, threshold=threshold
+        )
+        typer.echo(format_comparison(comparisons))
+        if any(c.regression for c in comparisons):
+            raise typer.Exit(1)
+
+
 @shell_app.command()
 def serve(
     component: str = typer.Argument(
@@ -109,6 +262,27 @@ def serve(
     port: int = typer.Option(
         8080, "--port", "-p", help="port to serve the component on"
     ),
+    session_ttl: Optional[float] = typer.Option(
+        None, help="evict sessions idle for more than this many seconds"
+    ),
+    max_sessions: Optional[int] = typer.Option(
+        None, help="evict least recently used sessions above this many sessions"
+    ),
+    session_store: Optional[str] = typer.Option(
+        None,
+        help="hibernate evicted sessions to sqlite:<path> or file:<directory> and rebuild them on their next input",
+    ),
+    workers: int = typer.Option(
+        1,
+        "--workers",
+        "-w",
+        help="worker processes, sessions are sharded between them by session id",
+    ),
+    single_process: bool = typer.Option(
+        False,
+        "--single-process",
+        help="serve from this process instead of a sanic worker process (with a single worker)",
+    ),
 ):
     """
     Serve on a local http server a component with cocohub exchange protocol
@@ -116,10 +290,15 @@ def serve(
     import sys
     import importlib
     from agt.cocohub_vendor import AgentCoCoApp
+    from agt.hibernation import session_store_from_url
 
     sys.path.append(".")
 
-    agent_app = AgentCoCoApp()
+    agent_app = AgentCoCoApp(
+        session_ttl=session_ttl,
+        max_sessions=max_sessions,
+        session_store=session_store_from_url(session_store) if session_store else None,
+    )
 
     comp_module_path, comp_module_name = component.rsplit(":", maxsplit=1)
     comp_module = importlib.import_module(comp_module_path)
@@ -133,4 +312,9 @@ def serve(
 
     agent_app.add_blueprint(comp, component_id=component_id, config=config_obj)
 
-    agent_app.run(host="0.0.0.0", port=port)
+    if workers > 1:
+        from agt.sharding import serve_sharded
+
+        serve_sharded(agent_app, workers, host="0.0.0.0", port=port)
+    else:
+        agent_app.run(host="0.0.0.0", port=port, single_process=single_process)
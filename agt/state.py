@@ -1,64 +1,93 @@
 """ conversation state definition """
+import hashlib
 import logging
+import os
 import typing as ta
 import uuid
 
 from asyncio import Queue, Event
+from collections import deque
 
-from pydantic import BaseModel
+from agt.conversation_log import BotEntry, ConversationLog, Message, UserEntry
+from agt.memory import Memory
+from agt.nlu.utterance import Utterance
 
 
 logger = logging.getLogger("agt")
 
+# in memory conversation log entries per session (unbounded if unset)
+LOG_RETENTION = int(os.environ.get("AGT_LOG_RETENTION", 0)) or None
+# directory to spill entries dropped from memory to, as <sha1 of session_id>.jsonl.gz
+LOG_SPILL_DIR = os.environ.get("AGT_LOG_SPILL_DIR")
+_log_spill_dir_created = False
 
-class Message(BaseModel):
-    text: str
-    image_url: ta.Optional[str]
-    ssml: ta.Optional[str]
+
+def log_spill_path(session_id: str) -> str:
+    """
+    spill file of a session, named by a hash - session ids come from urls
+    """
+    global _log_spill_dir_created
+    if not _log_spill_dir_created:
+        try:
+            os.makedirs(LOG_SPILL_DIR, exist_ok=True)
+            _log_spill_dir_created = True
+        except OSError as e:
+            logger.exception(e)
+    name = hashlib.sha1(str(session_id).encode("utf-8")).hexdigest()
+    return os.path.join(LOG_SPILL_DIR, f"{name}.jsonl.gz")
 
 
 def generate_session_id():
     return str(uuid.uuid4())
 
 
-class Entry:
-    def __init__(
-        self,
-        text: str = None,
-        image_url: ta.Optional[str] = None,
-        ssml: ta.Optional[str] = None,
-    ):
-        self.text = text
-        self.image_url = image_url
-        self.ssml = ssml
+class StateHooks:
+    """
+    Conversation events for instrumentation (e.g. agt.metrics)
+
+    called synchronously from the conversation - keep them cheap.
+    replayed turns of a hibernated session are not reported
+    """
 
-    def __repr__(self):
-        if self.image_url:
-            return " #img#: ".join([self.text or "", self.image_url])
-        return self.text or ""
+    def turn_start(self, state: "ConversationState") -> None:
+        pass
 
+    def turn_end(self, state: "ConversationState", seconds: float) -> None:
+        pass
 
-class BotEntry(Entry):
-    def __repr__(self):
-        return f"BOT >> {super().__repr__()}"
+    def say(self, state: "ConversationState", message: BotEntry) -> None:
+        pass
 
+    def user_input(self, state: "ConversationState", user_input: str) -> None:
+        pass
 
-class UserEntry(Entry):
-    def __repr__(self):
-        return f"USER >> {super().__repr__()}"
+    def out_of_context(self, state: "ConversationState", user_input: str) -> None:
+        pass
+
+    def remote_call(
+        self, state: "ConversationState", component_id: str, seconds: float, failed: bool
+    ) -> None:
+        pass
 
 
 class ConversationState:
     def __init__(self, output_callback):
         self.output_callback = output_callback
-        self.session_id: str = generate_session_id()
-        self.log: ta.List[Entry] = []
+        self.log = ConversationLog(retention=LOG_RETENTION)
+        self.session_id = generate_session_id()
         self.out_of_context_handlers = []
         self._inputs_queue = None
         self._bot_wait_for_input_event = Event()
+        # called (sync) when the bot blocks waiting for the next user input
+        self.wait_for_input_callback: ta.Optional[ta.Callable[[], None]] = None
+        self.hooks: ta.Optional[StateHooks] = None
 
         self.memory = {}
 
+        # rebuilding a hibernated session - recorded (context, user input) turns
+        self.replaying = False
+        self.replay_turns: ta.Deque[ta.Tuple[dict, str]] = deque()
+
     async def say(
         self,
         text: str,
@@ -75,9 +104,24 @@ class ConversationState:
         if image_url:
             logger.debug(f"BOT:{self.session_id}: {image_url}")
 
-        self.log.append(BotEntry(text=text, image_url=image_url, ssml=ssml))
+        if not (
+            isinstance(text, str)
+            and (image_url is None or isinstance(image_url, str))
+            and (ssml is None or isinstance(ssml, str))
+        ):
+            # rare - coerced or rejected (in the bot) by the Message validation
+            validated = Message(text=text, image_url=image_url, ssml=ssml)
+            text, image_url, ssml = validated.text, validated.image_url, validated.ssml
+
+        message = BotEntry(text=text, image_url=image_url, ssml=ssml)
+        self.log.append(message)
 
-        await self.output_callback(Message(text=text, image_url=image_url, ssml=ssml))
+        if self.replaying:
+            return
+
+        if self.hooks is not None:
+            self.hooks.say(self, message)
+        await self.output_callback(message)
 
     async def put_user_input(self, user_input: str):
         if not self._inputs_queue:
@@ -91,22 +135,77 @@ class ConversationState:
         Returns:
             str -- The user input
         """
-        if not self._inputs_queue:
-            # lazy load queue
-            self._inputs_queue = Queue()
-        if self._inputs_queue.empty():
-            self._bot_wait_for_input_event.set()
-        user_input = await self._inputs_queue.get()
+        replayed = bool(self.replay_turns)
+        if replayed:
+            context, user_input = self.replay_turns.popleft()
+            self.memory.update(context)
+        else:
+            if not self._inputs_queue:
+                # lazy load queue
+                self._inputs_queue = Queue()
+            if self._inputs_queue.empty():
+                self._bot_wait_for_input_event.set()
+                if self.wait_for_input_callback:
+                    self.wait_for_input_callback()
+            user_input = await self._inputs_queue.get()
+        # logged as a plain str - the utterance nlu_cache would keep the turn's NLU results alive
+        text = str(user_input) if isinstance(user_input, Utterance) else user_input
+        if isinstance(user_input, str):
+            # analyzed once and shared by all NLU calls this turn
+            user_input = Utterance(user_input)
         logger.debug(f"USER:{self.session_id}: {user_input}")
-        self.log.append(UserEntry(user_input))
+        self.log.append(UserEntry(text))
+        if self.hooks is not None and not replayed:
+            self.hooks.user_input(self, user_input)
         return user_input
 
+    def pending_inputs(self) -> int:
+        """
+        user inputs queued and not read by the bot yet
+        """
+        return self._inputs_queue.qsize() if self._inputs_queue else 0
+
+    def start_replay(self, turns: ta.Iterable[ta.Tuple[dict, str]]):
+        """
+        feed recorded turns to the bot without waiting and without output
+        """
+        self.replaying = True
+        self.replay_turns.extend(turns)
+
+    def stop_replay(self, memory: ta.Optional[dict] = None):
+        self.replaying = False
+        self.replay_turns.clear()
+        if memory is not None:
+            self.memory = memory
+
+    @property
+    def memory(self) -> Memory:
+        return self._memory
+
+    @memory.setter
+    def memory(self, memory: dict):
+        """
+        assigning a dict keeps tracking changes - only keys with new values are marked changed
+        """
+        if not hasattr(self, "_memory"):
+            self._memory = Memory(memory)
+        elif memory is not self._memory:
+            self._memory.replace(memory)
+
+    @property
+    def session_id(self) -> str:
+        return self._session_id
+
+    @session_id.setter
+    def session_id(self, session_id: str):
+        self._session_id = session_id
+        if LOG_SPILL_DIR:
+            self.log.flush()
+            self.log.spill_path = log_spill_path(session_id)
+
     def last_user_input(self) -> ta.Optional[str]:
-        last_user_input = next(
-            filter(lambda e: isinstance(e, UserEntry), reversed(self.log)), None
-        )
-        if last_user_input:
-            return last_user_input.text
+        if self.log.last_user_entry:
+            return self.log.last_user_entry.text
         return None
 
     def set_out_of_context_handler(self, handler: ta.Callable):
@@ -116,6 +215,8 @@ class ConversationState:
         self.out_of_context_handlers.pop()
 
     async def out_of_context(self, user_input: str, *args, **kwargs):
+        if self.hooks is not None and not self.replaying:
+            self.hooks.out_of_context(self, user_input)
         if len(self.out_of_context_handlers) > 0:
             await self.out_of_context_handlers[-1](self, user_input, *args, **kwargs)
 
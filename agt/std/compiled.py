@@ -0,0 +1,49 @@
+"""
+    Compile blueprint configs once and reuse the result across turns and sessions
+
+    Configs are keyed by a stable hash of their content, so identical configs
+    (e.g. the same hub component config fetched for many sessions) share one
+    compiled plan.
+"""
+import hashlib
+import json
+import os
+import typing as ta
+
+from pydantic import BaseModel
+
+from agt.nlu.word_regex import InternCache
+
+CONFIG_CACHE_SIZE = int(os.environ.get("AGT_CONFIG_CACHE_SIZE", 256))
+
+compiled_configs = InternCache(CONFIG_CACHE_SIZE)
+
+T = ta.TypeVar("T")
+
+
+def json_default(o):
+    if isinstance(o, BaseModel):
+        return o.dict()
+    return str(o)
+
+
+def config_hash(config) -> str:
+    if isinstance(config, str):
+        return config
+    return hashlib.sha1(
+        json.dumps(config, sort_keys=True, default=json_default).encode("utf-8")
+    ).hexdigest()
+
+
+def compile_config(compiler: ta.Callable[[ta.Any], T], config) -> T:
+    """
+    compiler(config) - computed once per distinct config content
+
+    Arguments:
+        compiler -- validates the config and builds an executable plan out of it
+        config -- json like config (dict, list or str)
+    """
+    return compiled_configs.get_or_create(
+        (compiler.__module__, compiler.__qualname__, config_hash(config)),
+        lambda: compiler(config),
+    )
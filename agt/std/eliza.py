@@ -1,38 +1,152 @@
 import random
 import re
+import typing as ta
 
 
 def reflect_input(user_input):
-    updated_input = user_input
-    for search_string, replacement in ELIZA_REFLECTIONS.items():
-        updated_input = re.sub(
-            f"(^|\s){search_string}(\s|$)",
-            f"\g<1>###{replacement}###\g<2>",
-            updated_input,
-            0,
-            re.IGNORECASE,
-        )
-    updated_input = updated_input.replace("###", "")
-    return updated_input
+    return eliza_engine.reflect(user_input)
 
 
 def get_eliza_response(user_input):
-    for pattern, response_alternates in ELIZA_PATTERNS:
-        m = re.match(pattern, user_input, re.IGNORECASE)
-        if m:
-            selected_response = random.choice(response_alternates)
-            for ig, g in enumerate(m.groups()):
-                reflected_group = reflect_input(g)
-                selected_response = selected_response.replace(
-                    f"%{ig+1}", reflected_group
-                )
-            return selected_response
+    return eliza_engine.respond(user_input)
 
 
 async def eliza_fallback(state, user_input):
     await state.say(get_eliza_response(user_input))
 
 
+def is_ascii(text: str) -> bool:
+    try:
+        text.encode("ascii")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def literal_prefix(pattern: str) -> str:
+    """
+    literal text any match of the pattern starts with ("" if unknown)
+    """
+    if "|" in pattern:
+        return ""
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        if pattern[i] == "\\":
+            char = pattern[i + 1 : i + 2]
+            if not char or char.isalnum():
+                break
+            width = 2
+        elif pattern[i] in ".^$*+?{}[]()":
+            break
+        else:
+            char = pattern[i]
+            width = 1
+        if pattern[i + width : i + width + 1] in ("?", "*", "{"):
+            break
+        prefix.append(char)
+        i += width
+    return "".join(prefix)
+
+
+class ElizaEngine:
+    """
+    ELIZA responder with precompiled patterns
+
+    - reflection of captured groups in a single regex pass
+    - patterns dispatched by their literal prefix so only candidates are tried
+
+    Produces the same responses as the sequential implementation for the same random seed
+    """
+
+    def __init__(
+        self,
+        patterns: ta.List[list] = None,
+        reflections: ta.Dict[str, str] = None,
+    ) -> None:
+        patterns = ELIZA_PATTERNS if patterns is None else patterns
+        self.reflections = ELIZA_REFLECTIONS if reflections is None else reflections
+
+        self.patterns = [
+            (re.compile(pattern, re.IGNORECASE), responses)
+            for pattern, responses in patterns
+        ]
+
+        # prefixes are matched case insensitive only for ascii text
+        prefixes = [literal_prefix(pattern) for pattern, _ in patterns]
+        self.max_prefix_len = max(map(len, prefixes), default=0)
+        unprefixed = []
+        self.dispatch: ta.Dict[str, ta.List[ta.Tuple[int, str]]] = {}
+        for index, prefix in enumerate(prefixes):
+            if not prefix or not is_ascii(prefix):
+                unprefixed.append(index)
+                for candidates in self.dispatch.values():
+                    candidates.append((index, ""))
+            else:
+                candidates = self.dispatch.setdefault(
+                    prefix[0].lower(), [(i, "") for i in unprefixed]
+                )
+                candidates.append((index, prefix.lower()))
+        self.unprefixed = [(index, "") for index in unprefixed]
+        self.all_patterns = [(index, "") for index in range(len(self.patterns))]
+
+        # (^|\s)word(\s|$) for each word without consuming the whitespace
+        self.reflection_pattern = re.compile(
+            "(?:^|(?<=\\s))("
+            + "|".join(self.reflections.keys())
+            + ")(?=\\s|$)",
+            re.IGNORECASE,
+        )
+
+    def reflection_key(self, word: str) -> str:
+        key = word.lower()
+        if key in self.reflections:
+            return key
+        return next(
+            k for k in self.reflections if re.fullmatch(k, word, re.IGNORECASE)
+        )
+
+    def reflect(self, user_input: str) -> str:
+        # substitution of a word consumes the whitespace that follows it,
+        # so the same word right after a single whitespace char is kept as is
+        last_end = {}
+
+        def replace(m):
+            key = self.reflection_key(m.group(1))
+            if m.start() > 0 and last_end.get(key) == m.start() - 1:
+                return m.group(1)
+            last_end[key] = m.end()
+            return f"###{self.reflections[key]}###"
+
+        updated_input = self.reflection_pattern.sub(replace, user_input)
+        return updated_input.replace("###", "")
+
+    def candidates(self, user_input: str) -> ta.List[ta.Tuple[int, str]]:
+        head = user_input[: self.max_prefix_len]
+        if not head or not is_ascii(head):
+            return self.all_patterns
+        return self.dispatch.get(head[0].lower(), self.unprefixed)
+
+    def respond(self, user_input: str) -> ta.Optional[str]:
+        lowered = user_input[: self.max_prefix_len].lower()
+        for index, prefix in self.candidates(user_input):
+            if prefix and not lowered.startswith(prefix):
+                continue
+            pattern, response_alternates = self.patterns[index]
+            m = pattern.match(user_input)
+            if m:
+                selected_response = random.choice(response_alternates)
+                for ig, g in enumerate(m.groups()):
+                    selected_response = selected_response.replace(
+                        f"%{ig+1}", self.reflect(g)
+                    )
+                return selected_response
+        return None
+
+    def respond_many(self, user_inputs: ta.Iterable[str]) -> ta.List[ta.Optional[str]]:
+        return [self.respond(user_input) for user_input in user_inputs]
+
+
 ELIZA_PATTERNS = [
     [
         r"I need (.*)",
@@ -390,3 +504,5 @@ ELIZA_REFLECTIONS = {
     "them": "they",
     "we": "you",
 }
+
+eliza_engine = ElizaEngine()
@@ -1,17 +1,27 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+import asyncio
 import enum
 import json
+import os
 import random
 
 from pydantic import BaseModel
 
 
-import coco.async_api as coco_sdk
 from coco import ccml
 
 import agt
 from agt.state import OutOfContext, Outputs, ConversationState
-from agt.nlu.word_regex import Intent, Pattern, WILDCARD
+from agt.nlu.word_regex import (
+    Intent,
+    IntentSet,
+    InternCache,
+    Pattern,
+    WILDCARD,
+    intern_intent,
+)
+from agt.std.compiled import compile_config
+from agt.http_pool import get_http_pool
 
 from coco.config_models import ActionsConfig, BlueprintConfig
 
@@ -101,57 +111,94 @@ def clean_keywords(keywords: List[str]) -> List[str]:
     return [k.strip() for k in keywords if isinstance(k, str) and len(k.strip()) > 0]
 
 
-async def oneturn_followup(state: agt.ConversationState, config=FOLLOWUP_CONFIG):
+class CompiledFollowups:
+    """
+    validated followups with a single matcher for all their intents
+    """
+
+    def __init__(self, followups: List[OneTurnFollowup]) -> None:
+        intents = []
+        self.intents_followups: List[Tuple[str, str]] = []
+        for fu in followups:
+            if fu.intent_name:
+                intents.append(available_intents[fu.intent_name.name])
+                self.intents_followups.append(
+                    (fu.followup_response, fu.intent_name.name)
+                )
+            if fu.keywords:
+                intents.append(
+                    intern_intent(WILDCARD, clean_keywords(fu.keywords), WILDCARD)
+                )
+                self.intents_followups.append((fu.followup_response, fu.keywords[0]))
+        self.intents = IntentSet(*intents)
+
+    def match(self, user_input: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns:
+            (followup_response, control) of the first matching followup
+        """
+        matched = self.intents.match(user_input)
+        if matched is not None:
+            return self.intents_followups[matched]
+        return None
+
+
+def compile_oneturn_config(config) -> CompiledFollowups:
     config_model: OneTurnConfig = OneTurnConfig.validate(config)
+    return CompiledFollowups(config_model.oneturn_followups)
+
+
+def compile_followups(followups) -> CompiledFollowups:
+    return CompiledFollowups([OneTurnFollowup.validate(fu) for fu in followups])
+
+
+async def say_followup(state: agt.ConversationState, followups: CompiledFollowups):
     user_input = await state.user_input()
-    for fu in config_model.oneturn_followups:
-        if fu.intent_name and available_intents[fu.intent_name.name](user_input):
-            await state.say(fu.followup_response)
-            return Outputs(control=fu.intent_name.name)
-        if fu.keywords and Intent(
-            Pattern(WILDCARD, clean_keywords(fu.keywords), WILDCARD)
-        )(user_input):
-            await state.say(fu.followup_response)
-            return Outputs(control=fu.keywords[0])
+    matched = followups.match(user_input)
+    if matched:
+        followup_response, control = matched
+        await state.say(followup_response)
+        return Outputs(control=control)
     await state.out_of_context(user_input)
 
 
+async def oneturn_followup(state: agt.ConversationState, config=FOLLOWUP_CONFIG):
+    return await say_followup(state, compile_config(compile_oneturn_config, config))
+
+
 SAY_CONFIG = ActionsConfig(
     blueprint_id="oneturn_say", action_config={"line": ["This is a line"]}
 ).dict()
 
 
-async def oneturn_say(state: agt.ConversationState, config=SAY_CONFIG):
+def compile_say_config(config) -> str:
     config_model: ActionsConfig = ActionsConfig.validate(config)
-    await state.say(config_model.action_config["line"][0])
+    return config_model.action_config["line"][0]
+
+
+async def oneturn_say(state: agt.ConversationState, config=SAY_CONFIG):
+    await state.say(compile_config(compile_say_config, config))
+
+
+def clear_xml_tags(line: str) -> str:
+    return ccml.parse.clear_xml_tags(line)
 
 
 async def oneturn_say_v2(state: agt.ConversationState, line="This is a line", **kwargs):
-    text = ccml.parse.clear_xml_tags(line)
+    text = compile_config(clear_xml_tags, line)
     await state.say(text=text, ssml=line)
 
 
 async def oneturn_say_v3(state: agt.ConversationState, lines=["This is a line"]):
     choosen_line = random.choice(lines)
-    text = ccml.parse.clear_xml_tags(choosen_line)
+    text = compile_config(clear_xml_tags, choosen_line)
     await state.say(text=text, ssml=choosen_line)
 
 
 async def oneturn_followup_v2(
     state: agt.ConversationState, followups: List[OneTurnFollowup] = []
 ):
-    user_input = await state.user_input()
-    for fu_dict in followups:
-        fu = OneTurnFollowup.validate(fu_dict)
-        if fu.intent_name and available_intents[fu.intent_name.name](user_input):
-            await state.say(fu.followup_response)
-            return Outputs(control=fu.intent_name.name)
-        if fu.keywords and Intent(
-            Pattern(WILDCARD, clean_keywords(fu.keywords), WILDCARD)
-        )(user_input):
-            await state.say(fu.followup_response)
-            return Outputs(control=fu.keywords[0])
-    await state.out_of_context(user_input)
+    return await say_followup(state, compile_config(compile_followups, followups))
 
 
 async def oneturn_say_followup(
@@ -195,37 +242,125 @@ class Branch(BaseModel):
     keywords: Optional[List[str]]
 
 
+class CompiledBranches:
+    """
+    validated navigation branches with a single matcher for the local intents
+    """
+
+    def __init__(self, branches: List[dict]) -> None:
+        self.branches: List[Branch] = [Branch.validate(branch) for branch in branches]
+        # (branch index, intent name) of branches with remote intents
+        self.remote_intents: List[Tuple[int, str]] = [
+            (branch_index, b.intent_name)
+            for branch_index, b in enumerate(self.branches)
+            if b.intent_name and b.intent_name not in available_intents
+        ]
+
+        intents = []
+        self.intents_branches: List[int] = []
+        for branch_index, b in enumerate(self.branches):
+            if b.intent_name and b.intent_name in available_intents:
+                intents.append(available_intents[b.intent_name])
+                self.intents_branches.append(branch_index)
+            if b.keywords:
+                intents.append(
+                    intern_intent(WILDCARD, clean_keywords(b.keywords), WILDCARD)
+                )
+                self.intents_branches.append(branch_index)
+        self.local_intents = IntentSet(*intents)
+
+    def first_local_match(self, user_input: str) -> Optional[int]:
+        """
+        Returns:
+            index of the first branch with a matching local intent
+        """
+        matched = self.local_intents.match(user_input)
+        if matched is not None:
+            return self.intents_branches[matched]
+        return None
+
+    def remote_intent_names(self, before_branch: Optional[int] = None) -> Tuple[str, ...]:
+        """
+        remote intents of the branches before before_branch (all if None)
+        """
+        names = [
+            name
+            for branch_index, name in self.remote_intents
+            if before_branch is None or branch_index < before_branch
+        ]
+        return tuple(dict.fromkeys(names))
+
+
+REMOTE_INTENTS_CACHE_SIZE = int(os.environ.get("AGT_REMOTE_INTENTS_CACHE_SIZE", 1024))
+# seconds - remote intent definitions can change
+REMOTE_INTENTS_CACHE_TTL = float(os.environ.get("AGT_REMOTE_INTENTS_CACHE_TTL", 300))
+
+# (intent names, normalized query) -> (expiry time, future of {intent name: result})
+remote_intents_cache = InternCache(REMOTE_INTENTS_CACHE_SIZE)
+
+
+def normalize_query(query: str) -> str:
+    """
+    query with whitespace collapsed - what is sent and cached
+    """
+    normalized = getattr(query, "normalized", None)
+    if normalized is not None:
+        return normalized
+    return " ".join(query.split())
+
+
+async def query_remote_intents(intent_names: Tuple[str, ...], query: str) -> Dict[str, bool]:
+    """
+    remote intents results by intent name, cached - concurrent identical queries share one request
+    """
+    loop = asyncio.get_event_loop()
+    normalized_query = normalize_query(query)
+    key = (intent_names, normalized_query)
+
+    cached = remote_intents_cache.entries.get(key)
+    if cached is not None and cached[0] <= loop.time():
+        del remote_intents_cache.entries[key]
+
+    async def query_intents():
+        results = await get_http_pool().query_intents(
+            intent_names=list(intent_names), query=normalized_query
+        )
+        return {r.name: r.result for r in results}
+
+    def forget_failed(future: asyncio.Future) -> None:
+        # failed or cancelled (e.g. on shutdown) - the next identical query tries again
+        if future.cancelled() or future.exception() is not None:
+            entry = remote_intents_cache.entries.get(key)
+            if entry is not None and entry[1] is future:
+                del remote_intents_cache.entries[key]
+
+    def start_query():
+        future = asyncio.ensure_future(query_intents())
+        future.add_done_callback(forget_failed)
+        return loop.time() + REMOTE_INTENTS_CACHE_TTL, future
+
+    _, future = remote_intents_cache.get_or_create(key, start_query)
+    # shielded - a cancelled navigation doesn't cancel the query for others
+    return await asyncio.shield(future)
+
+
 async def navigation(
     state: ConversationState, user_input=None, branches: List[Branch] = [], **kwargs
 ):
     user_input = user_input or await state.user_input()
 
-    classic_intent_names = list(
-        map(
-            lambda b: b.get("intent_name"),
-            filter(lambda b: "intent_name" in b and b["intent_name"]not in available_intents, branches),
-        )
-    )
-
-    classic_intents_results = await coco_sdk.query_intents(
-        intent_names=classic_intent_names, query=user_input
-    )
-
-    classic_intents_map = {r.name: r.result for r in classic_intents_results}
-
-    for branch in branches:
-        b = Branch.validate(branch)
-        if (
-            b.intent_name
-            and b.intent_name in available_intents
-            and available_intents[b.intent_name](user_input)
-        ):
-            return Outputs(control=b.branch_id)
-        elif b.intent_name and classic_intents_map.get(b.intent_name):
-            return Outputs(control=b.branch_id)
-        if b.keywords and Intent(
-            Pattern(WILDCARD, clean_keywords(b.keywords), WILDCARD)
-        )(user_input):
-            return Outputs(control=b.branch_id)
+    compiled_branches = compile_config(CompiledBranches, branches)
+
+    # local intents first - remote intents are queried only for branches before the local match
+    first_local_branch = compiled_branches.first_local_match(user_input)
+
+    remote_intent_names = compiled_branches.remote_intent_names(first_local_branch)
+    if remote_intent_names:
+        classic_intents_map = await query_remote_intents(remote_intent_names, user_input)
+        for b in compiled_branches.branches[:first_local_branch]:
+            if b.intent_name and classic_intents_map.get(b.intent_name):
+                return Outputs(control=b.branch_id)
+    if first_local_branch is not None:
+        return Outputs(control=compiled_branches.branches[first_local_branch].branch_id)
 
     await state.out_of_context(user_input)
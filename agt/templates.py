@@ -1,5 +1,15 @@
 import typing
-from agt.nlu.word_regex import Intent, Pattern, WILDCARD, AnyWords
+
+from agt.nlu.regex import RegexIntent
+from agt.nlu.word_regex import (
+    Intent,
+    IntentSet,
+    InternCache,
+    Pattern,
+    WILDCARD,
+    AnyWords,
+    intern_intent,
+)
 
 
 yes_intent = Intent(
@@ -30,25 +40,28 @@ def followup(intent, followup_action):
 
 
 def keywords(keywords_list, followup_action):
-    return Intent(Pattern(WILDCARD, keywords_list, WILDCARD)), followup_action
+    return intern_intent(WILDCARD, keywords_list, WILDCARD), followup_action
 
 
 def followups(*followups_intent_actions, yes=None, no=None, default=None):
+    followup_actions = []
+    if yes:
+        followup_actions.append((yes_intent, yes))
+    if no:
+        followup_actions.append((no_intent, no))
+
+    followup_actions.extend(followups_intent_actions)
+
+    followup_intents = IntentSet(*(intent for intent, _ in followup_actions))
+
     async def followup_comp(state, user_input=None):
         if not user_input:
             user_input = await state.user_input()
 
-        followup_actions = []
-        if yes:
-            followup_actions.append((yes_intent, yes))
-        if no:
-            followup_actions.append((no_intent, no))
-
-        followup_actions.extend(followups_intent_actions)
-
-        for intent, followup_action in followup_actions:
-            if intent(user_input):
-                return await pack_followup_action(state, followup_action)
+        matched = followup_intents.match(user_input)
+        if matched is not None:
+            _, followup_action = followup_actions[matched]
+            return await pack_followup_action(state, followup_action)
 
         if default:
             return await pack_followup_action(state, default)
@@ -56,10 +69,43 @@ def followups(*followups_intent_actions, yes=None, no=None, default=None):
     return followup_comp
 
 
+def intent_key(intent) -> typing.Optional[tuple]:
+    """
+    hashable key of what an intent matches (its pattern sources), None for other callables
+    """
+    if type(intent) is RegexIntent:
+        return (RegexIntent,) + tuple(p.pattern for p in intent.patterns)
+    if type(intent) is Intent and all(type(p) is Pattern for p in intent.patterns):
+        return (Intent, intent.preprocess_func) + tuple(
+            (p.pattern.pattern, p.token_matcher is not None) for p in intent.patterns
+        )
+    return None
+
+
+# by the keys of their intents - maps built on every call reuse the same IntentSet
+intent_sets_cache = InternCache(maxsize=256)
+
+
+def cached_intent_set(intents: tuple) -> typing.Optional[IntentSet]:
+    """
+    IntentSet of intents with the same patterns as these, None unless all are pattern intents
+    """
+    key = tuple(intent_key(intent) for intent in intents)
+    if None in key:
+        return None
+    return intent_sets_cache.get_or_create(key, lambda: IntentSet(*intents))
+
+
 async def pick_first_match(user_input, intent_map, default=None):
-    for intent, (callback, *args) in intent_map.items():
-        if intent(user_input):
-            return await callback(*args)
+    intents = tuple(intent_map.keys())
+    intent_set = cached_intent_set(intents)
+    if intent_set is not None:
+        matched = intent_set.match(user_input)
+    else:
+        matched = next((i for i, intent in enumerate(intents) if intent(user_input)), None)
+    if matched is not None:
+        callback, *args = intent_map[intents[matched]]
+        return await callback(*args)
     if default:
         func, *args = default
         return await func(*args)
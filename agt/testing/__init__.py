@@ -0,0 +1,14 @@
+from .emulator import (
+    CoCoEmulator,
+    ScriptedComponent,
+    constant_latency,
+    lognormal_latency,
+    uniform_latency,
+)
+from .simulator import (
+    Simulator,
+    VirtualClockEventLoop,
+    format_simulation,
+    run_with_virtual_clock,
+    simulation_metrics,
+)
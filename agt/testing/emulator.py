@@ -0,0 +1,272 @@
+"""
+    Offline CoCo hub emulator
+
+    A local http server speaking the exchange and intent query protocol used by agt.coco and navigation,
+    driven by scripted components, so bots calling remote components can be load tested and profiled
+    without the hub and with repeatable (seeded) latencies and failures.
+
+    emulator = CoCoEmulator(
+        components=[
+            ScriptedComponent("get_name", ["What is your name?", {"response": "Nice to meet you", "updated_context": {"name": "..."}}]),
+        ],
+        intents={"order_food": ["pizza", "burger"]},
+        latency=lognormal_latency(median_ms=50),
+        failure_rate=0.01,
+    )
+    async with emulator:
+        ...  # agt.coco() and navigation now call the emulator
+
+    or as a server for other processes - agt coco-emulator module:emulator --port 9000
+    and COCOHUB_URL=http://127.0.0.1:9000 for the served bot
+"""
+import asyncio
+import json
+import random
+import re
+import typing as ta
+
+from agt.http_pool import HttpPool, configure_http_pool, get_http_pool, set_http_pool
+
+LatencyFunc = ta.Callable[[random.Random], float]
+
+EXCHANGE_PATH_REGEX = re.compile(r"^/api/exchange/(?P<component_id>[^/]+)/(?P<session_id>[^/?]+)")
+CONFIG_PATH_REGEX = re.compile(r"^/api/fetch_component_config/(?P<component_id>[^/?]+)")
+INTENT_QUERY_PATH = "/v2/intent/query"
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+def no_latency(rng: random.Random) -> float:
+    return 0.0
+
+
+def constant_latency(ms: float) -> LatencyFunc:
+    return lambda rng: ms / 1000
+
+
+def uniform_latency(min_ms: float, max_ms: float) -> LatencyFunc:
+    return lambda rng: rng.uniform(min_ms, max_ms) / 1000
+
+
+def lognormal_latency(median_ms: float, sigma: float = 0.5) -> LatencyFunc:
+    """
+    long tailed latency around median_ms
+    """
+    return lambda rng: median_ms * rng.lognormvariate(0, sigma) / 1000
+
+
+class ScriptedComponent:
+    """
+    Remote component answering each session turn with the next script step
+
+    A step is a response text, an exchange response dict (response, responses, updated_context,
+    out_of_context, component_failed, outputs) or a callable (user_input, context) -> one of those.
+    After the last step the component is done with outputs.
+    """
+
+    def __init__(
+        self,
+        component_id: str,
+        script: ta.List[ta.Union[str, dict, ta.Callable[[str, dict], ta.Union[str, dict]]]],
+        outputs: ta.Optional[dict] = None,
+        config: ta.Optional[dict] = None,
+        latency: ta.Optional[LatencyFunc] = None,
+        failure_rate: ta.Optional[float] = None,
+    ) -> None:
+        self.component_id = component_id
+        self.script = script
+        self.outputs = outputs or {}
+        # served on /api/fetch_component_config/<component_id>
+        self.config = config
+        # override the emulator defaults
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def respond(self, turn: int, user_input: str, context: dict) -> dict:
+        step = self.script[min(turn, len(self.script) - 1)] if self.script else ""
+        if callable(step):
+            step = step(user_input, context)
+        if isinstance(step, str):
+            step = {"response": step}
+
+        done = turn >= len(self.script) - 1
+        response = {
+            "response": "",
+            "component_done": done,
+            "component_failed": False,
+            "updated_context": {},
+            "out_of_context": False,
+            "confidence": 1.0,
+            "outputs": self.outputs if done else {},
+        }
+        response.update(step)
+        return response
+
+
+class CoCoEmulator:
+    def __init__(
+        self,
+        components: ta.Iterable[ScriptedComponent] = (),
+        intents: ta.Optional[ta.Dict[str, ta.Union[ta.List[str], ta.Callable[[str], bool]]]] = None,
+        latency: LatencyFunc = no_latency,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        """
+        Arguments:
+            components -- scripted components by their component_id
+            intents -- intent name to keywords (matched as words in the query) or a predicate on the query
+            latency -- response latency in seconds, drawn per request
+            failure_rate -- fraction of requests answered with http 500
+            seed -- for repeatable latencies and failures
+        """
+        self.components = {c.component_id: c for c in components}
+        self.intents = {
+            name: intent if callable(intent) else keywords_predicate(intent)
+            for name, intent in (intents or {}).items()
+        }
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        # (component id, session id) -> turns so far
+        self.session_turns: ta.Dict[ta.Tuple[str, str], int] = {}
+        self.server: ta.Optional[asyncio.AbstractServer] = None
+        self.url: ta.Optional[str] = None
+        self.previous_pool: ta.Optional[HttpPool] = None
+
+        self.requests = 0
+        self.failures = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def use(self, **pool_kwargs) -> HttpPool:
+        """
+        point agt.coco and navigation (the shared http pool) at the emulator
+        """
+        self.previous_pool = get_http_pool()
+        return configure_http_pool(base_url=self.url, **pool_kwargs)
+
+    async def __aenter__(self) -> "CoCoEmulator":
+        await self.start()
+        self.use()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await get_http_pool().aclose()
+        if self.previous_pool is not None:
+            set_http_pool(self.previous_pool)
+            self.previous_pool = None
+        await self.stop()
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 9000) -> None:
+        await self.start(host, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = request_line.split(" ", 2)
+                headers = dict(
+                    line.lower().split(": ", 1) for line in header_lines if ": " in line
+                )
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, response = await self.handle(method, path, body)
+
+                data = json.dumps(response).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"content-type: application/json\r\n"
+                    f"content-length: {len(data)}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if headers.get("connection") == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, method: str, path: str, body: bytes) -> ta.Tuple[int, ta.Any]:
+        self.requests += 1
+        component = None
+        m = EXCHANGE_PATH_REGEX.match(path) or CONFIG_PATH_REGEX.match(path)
+        if m:
+            component = self.components.get(m.group("component_id"))
+
+        latency = component.latency if component and component.latency else self.latency
+        failure_rate = self.failure_rate
+        if component and component.failure_rate is not None:
+            failure_rate = component.failure_rate
+
+        delay = latency(self.rng)
+        if delay:
+            await asyncio.sleep(delay)
+        if failure_rate and self.rng.random() < failure_rate:
+            self.failures += 1
+            return 500, {"error": "Emulated failure"}
+
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "Invalid json"}
+
+        if path.startswith(INTENT_QUERY_PATH):
+            query = payload.get("query", "")
+            return 200, [
+                {
+                    "name": name,
+                    "result": bool(name in self.intents and self.intents[name](query)),
+                    "confidence": 1.0,
+                }
+                for name in payload.get("intent_names", [])
+            ]
+
+        if m and m.re is CONFIG_PATH_REGEX:
+            if component is None or component.config is None:
+                return 200, {"error": "Component not found"}
+            return 200, component.config
+
+        if m and m.re is EXCHANGE_PATH_REGEX:
+            if component is None:
+                return 404, {"error": f"Component {m.group('component_id')} not found"}
+            key = (component.component_id, m.group("session_id"))
+            turn = self.session_turns.get(key, 0)
+            response = component.respond(
+                turn, payload.get("user_input", ""), payload.get("context", {})
+            )
+            if response["component_done"]:
+                self.session_turns.pop(key, None)
+            else:
+                self.session_turns[key] = turn + 1
+            return 200, response
+
+        return 404, {"error": f"Unknown path {path}"}
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "active_sessions": len(self.session_turns),
+        }
+
+
+def keywords_predicate(keywords: ta.List[str]) -> ta.Callable[[str], bool]:
+    regex = re.compile(
+        r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")\b", re.IGNORECASE
+    )
+    return lambda query: bool(regex.search(query))
@@ -0,0 +1,321 @@
+"""
+    HTTP load generator for served blueprints (agt bench)
+
+    Simulated sessions run scripted multi-turn conversations through /api/exchange.
+    - closed model: `concurrency` sessions at a time, each starting when another ends
+    - open model: sessions arrive at `rate` per second (poisson), however slow the server is
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import typing as ta
+import uuid
+
+import httpx
+
+DEFAULT_SCRIPT = [["hello", "how are you?", "tell me something", "bye"]]
+
+# lower is better unless True
+BENCH_METRICS = {
+    "throughput.turns_per_s": True,
+    "throughput.sessions_per_s": True,
+    "latency_ms.p50": False,
+    "latency_ms.p95": False,
+    "latency_ms.p99": False,
+    "error_rate": False,
+    "rss_growth_kb_per_1k_sessions": False,
+}
+
+
+def load_script(path: ta.Optional[str]) -> ta.List[ta.List[dict]]:
+    """
+    conversations from a json file - a list of conversations, each a list of user inputs
+    (strings or exchange requests like {"user_input": ..., "context": {...}})
+    """
+    if path:
+        with open(path) as f:
+            conversations = json.load(f)
+    else:
+        conversations = DEFAULT_SCRIPT
+    return normalize_conversations(conversations)
+
+
+def normalize_conversations(conversations: ta.List[list]) -> ta.List[ta.List[dict]]:
+    return [
+        [turn if isinstance(turn, dict) else {"user_input": turn} for turn in conversation]
+        for conversation in conversations
+    ]
+
+
+def percentile(sorted_values: ta.List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def rss_kb(pid: ta.Optional[int]) -> ta.Optional[int]:
+    """
+    resident memory of a process (linux /proc), None if unavailable
+    """
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServedComponent:
+    """
+    agt serve of a component in a subprocess, serving from the subprocess itself (single process)
+    so its pid is the one to sample memory of
+    """
+
+    def __init__(
+        self,
+        component: str,
+        port: ta.Optional[int] = None,
+        serve_args: ta.Sequence[str] = (),
+    ) -> None:
+        self.component = component
+        self.port = port or free_port()
+        self.serve_args = list(serve_args)
+        self.process: ta.Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 30) -> None:
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "agt", "serve", self.component, "--port", str(self.port)]
+            + ["--single-process"]
+            + self.serve_args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(
+                    f"agt serve {self.component} exited with {self.process.returncode}"
+                )
+            try:
+                httpx.get(f"{self.url}/api/config/bench", timeout=1)
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        self.stop()
+        raise TimeoutError(f"agt serve {self.component} didn't start in {timeout}s")
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        url: str,
+        blueprint_id: str,
+        conversations: ta.List[ta.List[dict]],
+        sessions: int = 1000,
+        concurrency: int = 50,
+        rate: ta.Optional[float] = None,
+        duration: ta.Optional[float] = None,
+        timeout: float = 30,
+        server_pid: ta.Optional[int] = None,
+        seed: int = 0,
+    ) -> None:
+        """
+        Arguments:
+            sessions -- sessions to run (unless duration is set)
+            concurrency -- closed model sessions at a time / max connections in the open model
+            rate -- open model session arrivals per second
+            duration -- run for this many seconds instead of a number of sessions
+            server_pid -- process to sample resident memory of
+        """
+        self.url = url.rstrip("/")
+        self.blueprint_id = blueprint_id
+        self.conversations = conversations
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.timeout = timeout
+        self.server_pid = server_pid
+        self.rng = random.Random(seed)
+        self.run_id = uuid.uuid4().hex[:8]
+
+        self.latencies: ta.List[float] = []
+        self.errors = 0
+        self.component_failures = 0
+        self.sessions_started = 0
+        self.sessions_done = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # (sessions done, rss kb)
+        self.rss_samples: ta.List[ta.Tuple[int, int]] = []
+
+    def more_sessions(self, started_at: float) -> bool:
+        if self.duration is not None:
+            return time.perf_counter() - started_at < self.duration
+        return self.sessions_started < self.sessions
+
+    def next_session_number(self) -> int:
+        self.sessions_started += 1
+        return self.sessions_started - 1
+
+    async def run_session(self, client: httpx.AsyncClient, session_number: int) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        session_id = f"bench-{self.run_id}-{session_number}"
+        conversation = self.conversations[session_number % len(self.conversations)]
+        try:
+            for turn in conversation:
+                start = time.perf_counter()
+                try:
+                    rv = await client.post(
+                        f"{self.url}/api/exchange/{self.blueprint_id}/{session_id}",
+                        json=turn,
+                    )
+                    self.latencies.append(time.perf_counter() - start)
+                    if rv.status_code != 200:
+                        self.errors += 1
+                        break
+                    response = rv.json()
+                except (httpx.HTTPError, ValueError):
+                    self.latencies.append(time.perf_counter() - start)
+                    self.errors += 1
+                    break
+                if response.get("component_failed"):
+                    self.component_failures += 1
+                if response.get("component_done"):
+                    break
+        finally:
+            self.in_flight -= 1
+            self.sessions_done += 1
+            if self.sessions_done % 1000 == 0:
+                self.sample_rss()
+
+    def sample_rss(self) -> None:
+        rss = rss_kb(self.server_pid)
+        if rss is not None:
+            self.rss_samples.append((self.sessions_done, rss))
+
+    async def closed_workload(self, client: httpx.AsyncClient, started_at: float) -> None:
+        async def worker():
+            while self.more_sessions(started_at):
+                await self.run_session(client, self.next_session_number())
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+
+    async def open_workload(self, client: httpx.AsyncClient, started_at: float) -> None:
+        sessions = set()
+        next_arrival = time.perf_counter()
+        while self.more_sessions(started_at):
+            next_arrival += self.rng.expovariate(self.rate)
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            task = asyncio.ensure_future(
+                self.run_session(client, self.next_session_number())
+            )
+            sessions.add(task)
+            task.add_done_callback(sessions.discard)
+        if sessions:
+            await asyncio.gather(*sessions)
+
+    async def run(self) -> dict:
+        limits = httpx.Limits(
+            max_connections=self.concurrency, max_keepalive_connections=self.concurrency
+        )
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            self.sample_rss()
+            started_at = time.perf_counter()
+            if self.rate:
+                await self.open_workload(client, started_at)
+            else:
+                await self.closed_workload(client, started_at)
+            elapsed = time.perf_counter() - started_at
+            if not self.rss_samples or self.rss_samples[-1][0] != self.sessions_done:
+                self.sample_rss()
+        return self.results(elapsed)
+
+    def results(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies)
+        turns = len(latencies)
+        rss_growth = None
+        if len(self.rss_samples) >= 2 and self.sessions_done:
+            rss_growth = (self.rss_samples[-1][1] - self.rss_samples[0][1]) / (
+                self.sessions_done / 1000
+            )
+        return {
+            "config": {
+                "url": self.url,
+                "blueprint_id": self.blueprint_id,
+                "model": "open" if self.rate else "closed",
+                "concurrency": self.concurrency,
+                "rate": self.rate,
+                "duration": self.duration,
+                "sessions": self.sessions if self.duration is None else None,
+            },
+            "sessions": self.sessions_done,
+            "turns": turns,
+            "elapsed_s": elapsed,
+            "throughput": {
+                "turns_per_s": turns / elapsed if elapsed else 0.0,
+                "sessions_per_s": self.sessions_done / elapsed if elapsed else 0.0,
+            },
+            "latency_ms": {
+                "mean": sum(latencies) / turns * 1000 if turns else 0.0,
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "max": latencies[-1] * 1000 if latencies else 0.0,
+            },
+            "errors": self.errors,
+            "error_rate": self.errors / turns if turns else 0.0,
+            "component_failures": self.component_failures,
+            "max_in_flight": self.max_in_flight,
+            "rss_kb": [{"sessions": s, "rss_kb": r} for s, r in self.rss_samples],
+            "rss_growth_kb_per_1k_sessions": rss_growth,
+        }
+
+
+def format_results(results: dict) -> str:
+    latency = results["latency_ms"]
+    lines = [
+        f"{results['sessions']} sessions, {results['turns']} turns in {results['elapsed_s']:.2f}s"
+        f" ({results['config']['model']} model)",
+        f"throughput: {results['throughput']['turns_per_s']:.1f} turns/s,"
+        f" {results['throughput']['sessions_per_s']:.1f} sessions/s",
+        f"latency ms: mean {latency['mean']:.2f} p50 {latency['p50']:.2f} p95 {latency['p95']:.2f}"
+        f" p99 {latency['p99']:.2f} max {latency['max']:.2f}",
+        f"errors: {results['errors']} ({results['error_rate'] * 100:.2f}%),"
+        f" component failures: {results['component_failures']}",
+    ]
+    if results["rss_growth_kb_per_1k_sessions"] is not None:
+        lines.append(
+            f"server rss: {results['rss_kb'][0]['rss_kb']} -> {results['rss_kb'][-1]['rss_kb']} kB,"
+            f" {results['rss_growth_kb_per_1k_sessions']:.0f} kB per 1k sessions"
+        )
+    return os.linesep.join(lines)
@@ -0,0 +1,87 @@
+"""
+    Benchmark results as json and comparison with a saved baseline
+"""
+import json
+import typing as ta
+
+
+def flatten_metrics(results: dict, prefix: str = "") -> ta.Dict[str, float]:
+    """
+    numeric values of nested results by dotted path
+    """
+    metrics = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, prefix=f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[path] = value
+    return metrics
+
+
+class Comparison:
+    __slots__ = ("metric", "baseline", "current", "change", "regression")
+
+    def __init__(
+        self,
+        metric: str,
+        baseline: float,
+        current: float,
+        change: ta.Optional[float],
+        regression: bool,
+    ):
+        self.metric = metric
+        self.baseline = baseline
+        self.current = current
+        # relative change, None if the baseline is 0
+        self.change = change
+        self.regression = regression
+
+
+def compare_results(
+    current: dict,
+    baseline: dict,
+    metrics: ta.Dict[str, bool],
+    threshold: float = 0.1,
+) -> ta.List[Comparison]:
+    """
+    Arguments:
+        metrics -- dotted metric path to True if higher is better (throughput), False if lower is better (latency)
+        threshold -- relative change in the worse direction flagged as a regression
+    """
+    current_metrics = flatten_metrics(current)
+    baseline_metrics = flatten_metrics(baseline)
+    comparisons = []
+    for metric, higher_is_better in metrics.items():
+        if metric not in current_metrics or metric not in baseline_metrics:
+            continue
+        before, after = baseline_metrics[metric], current_metrics[metric]
+        change = (after - before) / abs(before) if before else None
+        if change is None:
+            worse = after < before if higher_is_better else after > before
+        else:
+            worse = -change > threshold if higher_is_better else change > threshold
+        comparisons.append(Comparison(metric, before, after, change, worse))
+    return comparisons
+
+
+def format_comparison(comparisons: ta.List[Comparison]) -> str:
+    width = max([len(c.metric) for c in comparisons] + [6])
+    lines = [f"{'metric':<{width}} {'baseline':>12} {'current':>12} {'change':>8}"]
+    for c in comparisons:
+        change = f"{c.change * 100:+.1f}%" if c.change is not None else "n/a"
+        flag = "  REGRESSION" if c.regression else ""
+        lines.append(
+            f"{c.metric:<{width}} {c.baseline:>12.4g} {c.current:>12.4g} {change:>8}{flag}"
+        )
+    return "\n".join(lines)
+
+
+def save_results(results: dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=True)
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,371 @@
+"""
+    In-process conversation simulator with a virtual clock
+
+    Drives many sessions of blueprints in one event loop from scripted turns, without a console or http.
+    The loop runs on a virtual clock - when nothing is ready to run, time jumps to the next timer,
+    so asyncio.sleep, timeouts and CoCoEmulator latencies take no real time.
+    Each bot step is metered, giving the cpu time and traced memory of every turn per blueprint.
+
+    async def eliza_bot(state):
+        with OutOfContext(state, eliza_fallback):
+            while True:
+                await state.out_of_context(await state.user_input())
+
+    simulator = Simulator()
+    simulator.add("oneturn_followup", oneturn_followup, [["yes"], ["no"], ["vanilla"]], sessions=1000)
+    simulator.add("eliza", eliza_bot, [["hello", "i am sad", "my mother hates me"]], sessions=1000)
+    results = simulator.run()
+    print(format_simulation(results))
+
+    with remote components, simulate inside the emulator (on the virtual clock as well)
+
+    async def simulate():
+        async with emulator:
+            return await simulator.simulate()
+
+    results = run_with_virtual_clock(simulate())
+
+    Remote stand-ins should run in the same loop - time keeps jumping while waiting for real io,
+    so timeouts of requests to other processes would expire early.
+"""
+import asyncio
+import collections.abc
+import os
+import selectors
+import time
+import tracemalloc
+import typing as ta
+
+from agt.server import BotSessionContainer
+from agt.testing.loadgen import normalize_conversations, percentile
+
+
+class VirtualClockSelector:
+    """
+    selector advancing the loop clock by the select timeout instead of blocking, unless io is ready
+    """
+
+    def __init__(self, selector: selectors.BaseSelector, loop: "VirtualClockEventLoop"):
+        self.selector = selector
+        self.loop = loop
+
+    def select(self, timeout: ta.Optional[float] = None):
+        ready = self.selector.select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            # no timers - only io can wake the loop
+            return self.selector.select(None)
+        self.loop.advance(timeout)
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, start: float = 0.0) -> None:
+        self.virtual_time = start
+        super().__init__(VirtualClockSelector(selectors.DefaultSelector(), self))
+
+    def time(self) -> float:
+        return self.virtual_time
+
+    def advance(self, seconds: float) -> None:
+        self.virtual_time += seconds
+
+
+def run_with_virtual_clock(coro: ta.Awaitable):
+    """
+    asyncio.run on a virtual clock loop
+    """
+    loop = VirtualClockEventLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class TurnMeter:
+    """
+    cpu time and traced memory of the bot steps since the last take()
+    """
+
+    __slots__ = ("trace_allocations", "cpu_ns", "allocated", "peak")
+
+    def __init__(self, trace_allocations: bool) -> None:
+        self.trace_allocations = trace_allocations
+        self.cpu_ns = 0
+        # net traced bytes kept
+        self.allocated = 0
+        # highest traced bytes above the start of a step
+        self.peak = 0
+
+    def measure(self, step: ta.Callable, *args):
+        if self.trace_allocations:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.thread_time_ns()
+        try:
+            return step(*args)
+        finally:
+            self.cpu_ns += time.thread_time_ns() - start
+            if self.trace_allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                self.allocated += current - start_memory
+                self.peak = max(self.peak, peak - start_memory)
+
+    def take(self) -> ta.Tuple[int, int, int]:
+        taken = self.cpu_ns, self.allocated, self.peak
+        self.cpu_ns = self.allocated = self.peak = 0
+        return taken
+
+
+class MeteredCoroutine(collections.abc.Coroutine):
+    """
+    a coroutine with every step (send / throw) measured by a TurnMeter
+    """
+
+    __slots__ = ("coro", "meter")
+
+    def __init__(self, coro: ta.Coroutine, meter: TurnMeter) -> None:
+        self.coro = coro
+        self.meter = meter
+
+    def send(self, value):
+        return self.meter.measure(self.coro.send, value)
+
+    def throw(self, *args):
+        return self.meter.measure(self.coro.throw, *args)
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+
+class SimulatedBlueprint:
+    def __init__(
+        self,
+        name: str,
+        bot: ta.Callable[..., ta.Coroutine],
+        conversations: ta.List[ta.List[dict]],
+        sessions: int,
+        think_time: float,
+    ) -> None:
+        self.name = name
+        self.bot = bot
+        self.conversations = conversations
+        self.sessions = sessions
+        self.think_time = think_time
+
+        self.cpu_ns: ta.List[int] = []
+        self.allocated: ta.List[int] = []
+        self.peaks: ta.List[int] = []
+        self.virtual_latencies: ta.List[float] = []
+        self.responses = 0
+        self.out_of_context = 0
+        self.completed = 0
+        self.errors = 0
+
+    def results(self, trace_allocations: bool) -> dict:
+        cpu_us = sorted(ns / 1000 for ns in self.cpu_ns)
+        latencies = sorted(self.virtual_latencies)
+        turns = len(cpu_us)
+        results = {
+            "sessions": self.sessions,
+            "completed": self.completed,
+            "errors": self.errors,
+            "turns": turns,
+            "responses": self.responses,
+            "out_of_context": self.out_of_context,
+            "cpu_us": summary(cpu_us),
+            "virtual_latency_ms": summary([s * 1000 for s in latencies]),
+        }
+        if trace_allocations:
+            results["allocated_kb"] = summary(sorted(b / 1024 for b in self.allocated))
+            results["peak_kb"] = summary(sorted(b / 1024 for b in self.peaks))
+        return results
+
+
+def summary(sorted_values: ta.List[float]) -> dict:
+    return {
+        "mean": sum(sorted_values) / len(sorted_values) if sorted_values else 0.0,
+        "p50": percentile(sorted_values, 50),
+        "p95": percentile(sorted_values, 95),
+        "p99": percentile(sorted_values, 99),
+        "max": sorted_values[-1] if sorted_values else 0.0,
+    }
+
+
+class Simulator:
+    def __init__(
+        self, concurrency: ta.Optional[int] = None, trace_allocations: bool = True
+    ) -> None:
+        """
+        Arguments:
+            concurrency -- sessions at a time (all at once if None)
+            trace_allocations -- trace memory per turn with tracemalloc, which slows the steps down
+                as well - compare cpu times only between runs with the same setting
+        """
+        self.concurrency = concurrency
+        self.trace_allocations = trace_allocations
+        self.blueprints: ta.Dict[str, SimulatedBlueprint] = {}
+
+    def add(
+        self,
+        name: str,
+        bot: ta.Callable[..., ta.Coroutine],
+        conversations: ta.List[list],
+        sessions: int = 1000,
+        think_time: float = 0.0,
+    ) -> None:
+        """
+        Arguments:
+            bot -- blueprint coroutine function of the conversation state (functools.partial for params)
+            conversations -- scripted conversations, each a list of user inputs
+                (strings or {"user_input": ..., "context": {...}}), sessions take them in turn
+            think_time -- virtual seconds before each user input
+        """
+        self.blueprints[name] = SimulatedBlueprint(
+            name, bot, normalize_conversations(conversations), sessions, think_time
+        )
+
+    async def run_session(
+        self,
+        blueprint: SimulatedBlueprint,
+        session_number: int,
+        limit: ta.Optional[asyncio.Semaphore],
+    ) -> None:
+        if limit:
+            async with limit:
+                return await self.run_session(blueprint, session_number, None)
+
+        loop = asyncio.get_event_loop()
+        meter = TurnMeter(self.trace_allocations)
+        sc = BotSessionContainer(lambda state: MeteredCoroutine(blueprint.bot(state), meter))
+        sc.conv_state.session_id = f"sim-{blueprint.name}-{session_number}"
+        conversation = blueprint.conversations[session_number % len(blueprint.conversations)]
+        try:
+            for turn in conversation:
+                if blueprint.think_time:
+                    await asyncio.sleep(blueprint.think_time)
+                if sc.bot_task.done():
+                    break
+                start = loop.time()
+                await sc.exchange_turn(turn["user_input"], turn.get("context"))
+                cpu_ns, allocated, peak = meter.take()
+                blueprint.cpu_ns.append(cpu_ns)
+                blueprint.allocated.append(allocated)
+                blueprint.peaks.append(peak)
+                blueprint.virtual_latencies.append(loop.time() - start)
+                blueprint.responses += len(sc.responses)
+                sc.clear_responses()
+                if sc.out_of_context_event.is_set():
+                    blueprint.out_of_context += 1
+                    sc.out_of_context_event.clear()
+        finally:
+            if not sc.bot_task.done():
+                sc.bot_task.cancel()
+                await asyncio.gather(sc.bot_task, return_exceptions=True)
+            elif sc.bot_task.cancelled() or sc.bot_task.exception() is not None:
+                blueprint.errors += 1
+            else:
+                blueprint.completed += 1
+
+    async def simulate(self) -> dict:
+        """
+        run all sessions in the running loop
+        """
+        loop = asyncio.get_event_loop()
+        limit = asyncio.Semaphore(self.concurrency) if self.concurrency else None
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            stop_tracing = True
+        else:
+            stop_tracing = False
+        started_at = time.perf_counter()
+        virtual_started_at = loop.time()
+        cpu_started_at = time.process_time()
+        try:
+            await asyncio.gather(
+                *[
+                    self.run_session(blueprint, session_number, limit)
+                    for blueprint in self.blueprints.values()
+                    for session_number in range(blueprint.sessions)
+                ]
+            )
+        finally:
+            if stop_tracing:
+                tracemalloc.stop()
+        return {
+            "elapsed_s": time.perf_counter() - started_at,
+            "virtual_s": loop.time() - virtual_started_at,
+            "cpu_s": time.process_time() - cpu_started_at,
+            "trace_allocations": self.trace_allocations,
+            "blueprints": {
+                name: blueprint.results(self.trace_allocations)
+                for name, blueprint in self.blueprints.items()
+            },
+        }
+
+    def run(self) -> dict:
+        """
+        run all sessions in a new virtual clock loop
+        """
+        return run_with_virtual_clock(self.simulate())
+
+
+def simulation_metrics(results: dict) -> ta.Dict[str, bool]:
+    """
+    per blueprint metrics for agt.testing.compare_results (all lower is better)
+    """
+    metrics = {}
+    for name, blueprint in results["blueprints"].items():
+        for metric in ("cpu_us", "allocated_kb", "peak_kb"):
+            if metric in blueprint:
+                metrics[f"blueprints.{name}.{metric}.mean"] = False
+                metrics[f"blueprints.{name}.{metric}.p95"] = False
+        metrics[f"blueprints.{name}.errors"] = False
+    return metrics
+
+
+def format_simulation(results: dict) -> str:
+    lines = [
+        f"simulated {results['virtual_s']:.2f}s in {results['elapsed_s']:.2f}s"
+        f" ({results['cpu_s']:.2f}s cpu)"
+    ]
+    for name, blueprint in results["blueprints"].items():
+        cpu = blueprint["cpu_us"]
+        lines.append(
+            f"{name}: {blueprint['sessions']} sessions, {blueprint['turns']} turns,"
+            f" {blueprint['completed']} completed, {blueprint['errors']} errors,"
+            f" {blueprint['out_of_context']} out of context"
+        )
+        lines.append(
+            f"  cpu us/turn: mean {cpu['mean']:.1f} p50 {cpu['p50']:.1f} p95 {cpu['p95']:.1f}"
+            f" p99 {cpu['p99']:.1f} max {cpu['max']:.1f}"
+        )
+        if "allocated_kb" in blueprint:
+            allocated, peak = blueprint["allocated_kb"], blueprint["peak_kb"]
+            lines.append(
+                f"  kB/turn: kept mean {allocated['mean']:.2f} p95 {allocated['p95']:.2f},"
+                f" peak mean {peak['mean']:.2f} p95 {peak['p95']:.2f}"
+            )
+    return os.linesep.join(lines)
@@ -0,0 +1,54 @@
+"""
+    IntentSet vs sequential intent evaluation throughput
+
+    python -m benchmarks.intent_set
+"""
+import timeit
+
+from agt.nlu.word_regex import Intent, IntentSet, Pattern, WILDCARD
+
+UTTERANCES = [
+    "i would like to hear about something completely different please",
+    "tell me about keyword7",
+    "no",
+    "what is the weather like today in the middle of the city",
+]
+
+
+def build_intents(n):
+    return [
+        Intent(Pattern(WILDCARD, (f"keyword{i}", f"synonym{i}"), WILDCARD))
+        for i in range(n)
+    ]
+
+
+def sequential_match(intents, user_input):
+    for i, intent in enumerate(intents):
+        if intent(user_input):
+            return i
+    return None
+
+
+def run(intents_counts=(5, 10, 20, 40, 80, 160), number=2000):
+    print(f"{'intents':>8} {'sequential/s':>14} {'IntentSet/s':>14} {'speedup':>8}")
+    for n in intents_counts:
+        intents = build_intents(n)
+        intent_set = IntentSet(*intents)
+
+        for u in UTTERANCES:
+            assert sequential_match(intents, u) == intent_set.match(u)
+
+        sequential = timeit.timeit(
+            lambda: [sequential_match(intents, u) for u in UTTERANCES], number=number
+        )
+        merged = timeit.timeit(
+            lambda: [intent_set.match(u) for u in UTTERANCES], number=number
+        )
+        total = number * len(UTTERANCES)
+        print(
+            f"{n:>8} {total / sequential:>14.0f} {total / merged:>14.0f} {sequential / merged:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    run()
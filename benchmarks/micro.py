@@ -0,0 +1,282 @@
+"""
+    Microbenchmarks of nlu, eliza and conversation state hot paths
+
+    Each case is timed in batches sized to take at least --min-time seconds, the best of --repeat
+    batches is kept as ns per operation.
+
+    python -m benchmarks.micro --output before.json              # run all cases, save the results
+    python -m benchmarks.micro --baseline before.json            # compare, exits 1 on a regression
+    python -m benchmarks.micro word_regex eliza                  # only cases starting with these names
+"""
+import argparse
+import asyncio
+import platform
+import random
+import sys
+import time
+import typing as ta
+
+from agt.nlu.regex import RegexIntent
+from agt.nlu.word_regex import AnyWords, Intent, Pattern, Slots, WILDCARD, Words
+from agt.server import BotSessionContainer
+from agt.state import ConversationState
+from agt.std.eliza import get_eliza_response, reflect_input
+from agt.testing.results import compare_results, format_comparison, load_results, save_results
+
+SHORT_INPUT = "yes of course"
+LONG_INPUT = (
+    "well i was thinking about it for a while and to be honest i am not sure what to say "
+    "but if you ask me whether the boy ate an apple yesterday in the park then yes of course"
+)
+NO_MATCH_LONG_INPUT = LONG_INPUT.replace("yes of course", "maybe")
+ELIZA_SHORT_INPUT = "i am sad"
+ELIZA_LONG_INPUT = (
+    "i feel like my mother never listens to me and you are the only one who does, "
+    "because i am tired of explaining myself to everyone around me"
+)
+
+
+def adversarial_input(words: int) -> str:
+    """
+    long non matching input, backtracks on AnyWords followed by a missing word
+    """
+    return " ".join(["word"] * words) + " !"
+
+
+# the regex backend backtracks exponentially on adversarial inputs, keep them small
+REGEX_ADVERSARIAL_WORDS = 10
+TOKENS_ADVERSARIAL_WORDS = 1000
+
+# case name -> setup returning a function running the case number times
+CASES: ta.Dict[str, ta.Callable[[], ta.Callable[[int], None]]] = {}
+
+
+def case(name: str):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+def repeat_call(func: ta.Callable, *args) -> ta.Callable[[int], None]:
+    def run(number: int) -> None:
+        for _ in range(number):
+            func(*args)
+
+    return run
+
+
+def adversarial_intent(backend: str) -> Intent:
+    return Intent(
+        Pattern(WILDCARD, AnyWords(min=1, max=30), "zzz", backend=backend),
+        Pattern(WILDCARD, ("yes", "of course"), WILDCARD, backend=backend),
+    )
+
+
+def yes_pattern() -> Pattern:
+    return Pattern(WILDCARD, ("yes", "yea", "sure", "of course"), WILDCARD)
+
+
+@case("word_regex.pattern.short")
+def pattern_short():
+    return repeat_call(yes_pattern(), SHORT_INPUT)
+
+
+@case("word_regex.pattern.long")
+def pattern_long():
+    return repeat_call(yes_pattern(), LONG_INPUT)
+
+
+@case("word_regex.pattern.long_no_match")
+def pattern_long_no_match():
+    return repeat_call(yes_pattern(), NO_MATCH_LONG_INPUT)
+
+
+@case("word_regex.intent.short")
+def intent_short():
+    intent = Intent(
+        Pattern("the", Words("boy", "girl"), "ate", "an", AnyWords(min=1, max=1)),
+        yes_pattern(),
+    )
+    return repeat_call(intent, SHORT_INPUT)
+
+
+@case("word_regex.intent.long")
+def intent_long():
+    intent = Intent(
+        Pattern(WILDCARD, Words("boy", "girl"), "ate", "an", AnyWords(min=1, max=1), WILDCARD),
+        yes_pattern(),
+    )
+    return repeat_call(intent, NO_MATCH_LONG_INPUT)
+
+
+@case("word_regex.intent.adversarial_regex")
+def intent_adversarial_regex():
+    return repeat_call(adversarial_intent("regex"), adversarial_input(REGEX_ADVERSARIAL_WORDS))
+
+
+@case("word_regex.intent.adversarial_tokens")
+def intent_adversarial_tokens():
+    return repeat_call(adversarial_intent("tokens"), adversarial_input(TOKENS_ADVERSARIAL_WORDS))
+
+
+def eating_slots() -> Slots:
+    return Slots(
+        Pattern(
+            WILDCARD,
+            Words("boy", "girl", name="who"),
+            "ate",
+            "an",
+            AnyWords(min=1, max=1, name="what"),
+            WILDCARD,
+        )
+    )
+
+
+@case("word_regex.slots.short")
+def slots_short():
+    return repeat_call(eating_slots(), "the boy ate an apple")
+
+
+@case("word_regex.slots.long")
+def slots_long():
+    return repeat_call(eating_slots(), LONG_INPUT)
+
+
+def yes_regex_intent() -> RegexIntent:
+    return RegexIntent(r"^(?:.*\s)?(?:yes|yea|sure|of course)(?:\s.*)?$", r"^(?:y|k)$")
+
+
+@case("regex.intent.short")
+def regex_intent_short():
+    return repeat_call(yes_regex_intent(), SHORT_INPUT)
+
+
+@case("regex.intent.long")
+def regex_intent_long():
+    return repeat_call(yes_regex_intent(), NO_MATCH_LONG_INPUT)
+
+
+@case("eliza.response.short")
+def eliza_response_short():
+    random.seed(0)
+    return repeat_call(get_eliza_response, ELIZA_SHORT_INPUT)
+
+
+@case("eliza.response.long")
+def eliza_response_long():
+    random.seed(0)
+    return repeat_call(get_eliza_response, ELIZA_LONG_INPUT)
+
+
+@case("eliza.reflect.long")
+def eliza_reflect_long():
+    return repeat_call(reflect_input, ELIZA_LONG_INPUT)
+
+
+def run_in_loop(coro_func: ta.Callable[[int], ta.Coroutine]) -> ta.Callable[[int], None]:
+    loop = asyncio.new_event_loop()
+
+    def run(number: int) -> None:
+        loop.run_until_complete(coro_func(number))
+
+    return run
+
+
+@case("state.say_user_input")
+def state_round_trip():
+    async def output(message):
+        pass
+
+    async def round_trips(number: int):
+        # a fresh state per batch - the conversation log grows with every turn
+        state = ConversationState(output)
+        for _ in range(number):
+            await state.put_user_input(SHORT_INPUT)
+            user_input = await state.user_input()
+            await state.say(user_input)
+
+    return run_in_loop(round_trips)
+
+
+@case("server.session_container")
+def session_container_creation():
+    async def bot(state):
+        await state.user_input()
+
+    async def create(number: int):
+        containers = [BotSessionContainer(bot) for _ in range(number)]
+        for sc in containers:
+            sc.bot_task.cancel()
+        await asyncio.gather(*[sc.bot_task for sc in containers], return_exceptions=True)
+
+    return run_in_loop(create)
+
+
+def timed(run: ta.Callable[[int], None], number: int) -> float:
+    start = time.perf_counter()
+    run(number)
+    return time.perf_counter() - start
+
+
+def time_case(run: ta.Callable[[int], None], min_time: float, repeat: int) -> dict:
+    number = 1
+    while True:
+        elapsed = timed(run, number)
+        if elapsed >= min_time:
+            break
+        # grow towards min_time, at most 10x at a time
+        number = max(number + 1, int(number * min(10.0, 1.2 * min_time / max(elapsed, 1e-9))))
+    best = min([elapsed] + [timed(run, number) for _ in range(repeat - 1)])
+    ns_per_op = best / number * 1e9
+    return {"ns_per_op": ns_per_op, "ops_per_s": 1e9 / ns_per_op, "number": number}
+
+
+def run_cases(
+    prefixes: ta.Sequence[str] = (), min_time: float = 0.2, repeat: int = 5
+) -> dict:
+    results = {}
+    for name, setup in CASES.items():
+        if prefixes and not name.startswith(tuple(prefixes)):
+            continue
+        results[name] = time_case(setup(), min_time, repeat)
+        print(f"{name:<40} {results[name]['ns_per_op']:>14.1f} ns/op", flush=True)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": results,
+    }
+
+
+def case_metrics(results: dict) -> ta.Dict[str, bool]:
+    return {f"cases.{name}.ns_per_op": False for name in results["cases"]}
+
+
+def main(argv: ta.Optional[ta.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="agt microbenchmarks")
+    parser.add_argument("prefixes", nargs="*", help="run only cases starting with these")
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--baseline", help="compare with the json results of a previous run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="relative slowdown flagged as a regression"
+    )
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per batch")
+    parser.add_argument("--repeat", type=int, default=5, help="batches per case")
+    args = parser.parse_args(argv)
+
+    results = run_cases(args.prefixes, min_time=args.min_time, repeat=args.repeat)
+    if args.output:
+        save_results(results, args.output)
+    if args.baseline:
+        comparisons = compare_results(
+            results, load_results(args.baseline), case_metrics(results), threshold=args.threshold
+        )
+        print(format_comparison(comparisons))
+        if any(c.regression for c in comparisons):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
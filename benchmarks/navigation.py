@@ -0,0 +1,97 @@
+"""
+    navigation latency - local intents first with cached remote intents
+    vs querying the remote intents before checking any branch
+
+    Remote intents are answered by the stand-in hub of benchmarks.remote_calls with latency_ms per query.
+
+    python -m benchmarks.navigation [turns] [latency_ms]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from agt.http_pool import configure_http_pool, get_http_pool
+from agt.state import ConversationState, Outputs
+from agt.std import oneturn
+from agt.std.compiled import compile_config
+from benchmarks.remote_calls import stand_in_hub
+
+BRANCHES = [
+    {"branch_id": "menu", "keywords": ["menu", "options"]},
+    {"branch_id": "agree", "intent_name": "yes"},
+    {"branch_id": "order", "intent_name": "order_food"},
+    {"branch_id": "help", "intent_name": "get_help", "keywords": ["help"]},
+]
+
+INPUTS = [
+    "show me the menu",  # local match on the first branch - no remote query needed
+    "yes please",  # local match after no remote branches
+    "i would like a pizza",  # remote intents decide
+    "help",  # local match after a remote branch
+]
+
+
+async def remote_first_navigation(state, user_input, branches):
+    """
+    navigation querying all remote intents before checking branches (previous behavior)
+    """
+    compiled_branches = compile_config(oneturn.CompiledBranches, branches)
+    results = await get_http_pool().query_intents(
+        intent_names=list(compiled_branches.remote_intent_names()), query=user_input
+    )
+    classic_intents_map = {r.name: r.result for r in results}
+    first_local_branch = compiled_branches.first_local_match(user_input)
+    for b in compiled_branches.branches[:first_local_branch]:
+        if b.intent_name and classic_intents_map.get(b.intent_name):
+            return Outputs(control=b.branch_id)
+    if first_local_branch is not None:
+        return Outputs(control=compiled_branches.branches[first_local_branch].branch_id)
+
+
+async def local_first_navigation(state, user_input, branches):
+    return await oneturn.navigation(state, user_input=user_input, branches=branches)
+
+
+async def output(message):
+    pass
+
+
+async def measure(navigation, turns: int):
+    latencies = {u: [] for u in INPUTS}
+    state = ConversationState(output)
+    state.set_out_of_context_handler(lambda *args, **kwargs: asyncio.sleep(0))
+    for _ in range(turns):
+        for u in INPUTS:
+            start = time.perf_counter()
+            await navigation(state, u, BRANCHES)
+            latencies[u].append(time.perf_counter() - start)
+    return {u: statistics.mean(l) for u, l in latencies.items()}
+
+
+async def main(turns: int, latency_ms: float):
+    server = await stand_in_hub(handshake_ms=0, latency_ms=latency_ms)
+    host, port = server.sockets[0].getsockname()[:2]
+    configure_http_pool(base_url=f"http://{host}:{port}")
+
+    remote_first = await measure(remote_first_navigation, turns)
+    oneturn.remote_intents_cache.clear()
+    local_first = await measure(local_first_navigation, turns)
+
+    print(f"remote latency {latency_ms}ms, {turns} turns per input, mean ms")
+    print(f"{'input':>24} {'remote first':>13} {'local first':>12}")
+    for u in INPUTS:
+        print(f"{u:>24} {remote_first[u] * 1000:>13.2f} {local_first[u] * 1000:>12.2f}")
+    print(oneturn.remote_intents_cache.stats())
+
+    await get_http_pool().aclose()
+    server.close()
+    await server.wait_closed()
+
+
+def run(turns=100, latency_ms=20.0):
+    asyncio.run(main(int(turns), float(latency_ms)))
+
+
+if __name__ == "__main__":
+    run(*sys.argv[1:])
@@ -0,0 +1,45 @@
+"""
+    regex vs tokens Pattern backends on adversarial (long, non matching) inputs
+
+    python -m benchmarks.nlu_backends
+"""
+import time
+
+from agt.nlu.word_regex import AnyWords, Intent, Pattern, WILDCARD
+
+# the regex backend backtracks exponentially on these, keep it to small inputs
+REGEX_MAX_WORDS = 20
+
+
+def build_intent(backend):
+    return Intent(
+        Pattern(WILDCARD, AnyWords(min=1, max=30), "zzz", backend=backend),
+        Pattern(WILDCARD, ("yes", "of course"), WILDCARD, backend=backend),
+    )
+
+
+def adversarial_input(words):
+    return " ".join(["word"] * words) + " !"
+
+
+def timed(intent, user_input):
+    start_time = time.perf_counter()
+    intent(user_input)
+    return time.perf_counter() - start_time
+
+
+def run(words_counts=(8, 12, 16, 18, 20, 100, 1000, 10000)):
+    intents = {backend: build_intent(backend) for backend in ("regex", "tokens")}
+    print(f"{'words':>8} {'regex (s)':>12} {'tokens (s)':>12}")
+    for words in words_counts:
+        user_input = adversarial_input(words)
+        regex_time = (
+            f"{timed(intents['regex'], user_input):>12.6f}"
+            if words <= REGEX_MAX_WORDS
+            else f"{'skipped':>12}"
+        )
+        print(f"{words:>8} {regex_time} {timed(intents['tokens'], user_input):>12.6f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,108 @@
+"""
+    Remote component call latency with and without connection reuse
+
+    Runs a local stand-in for the hub exchange / intent query endpoints which delays the first
+    request of every connection by handshake_ms (standing in for TCP + TLS setup to a remote hub),
+    then compares coco.async_api (new client per call) with the shared agt.http_pool.
+
+    python -m benchmarks.remote_calls [calls] [handshake_ms]
+"""
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+import coco.async_api as coco_sdk
+
+from agt.http_pool import HttpPool
+
+EXCHANGE_RESPONSE = json.dumps(
+    {
+        "response": "ok",
+        "component_done": False,
+        "component_failed": False,
+        "updated_context": {},
+        "out_of_context": False,
+        "outputs": {},
+    }
+).encode("utf-8")
+INTENTS_RESPONSE = json.dumps([{"name": "yes", "result": True, "confidence": 1.0}]).encode(
+    "utf-8"
+)
+
+
+async def stand_in_hub(host="127.0.0.1", port=0, handshake_ms=5.0, latency_ms=0.0):
+    """
+    minimal keep-alive http/1.1 server answering exchange and intent queries,
+    each response is delayed by latency_ms
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await asyncio.sleep(handshake_ms / 1000)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                headers = dict(
+                    line.lower().split(": ", 1) for line in header_lines if ": " in line
+                )
+                await reader.readexactly(int(headers.get("content-length", 0)))
+                if latency_ms:
+                    await asyncio.sleep(latency_ms / 1000)
+                body = INTENTS_RESPONSE if "/intent/" in request_line else EXCHANGE_RESPONSE
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                    + f"content-length: {len(body)}\r\n\r\n".encode("latin-1")
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def measure(call, calls: int):
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter()
+        await call(i)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.95)]
+
+
+async def main(calls: int, handshake_ms: float):
+    server = await stand_in_hub(handshake_ms=handshake_ms)
+    host, port = server.sockets[0].getsockname()[:2]
+    url = f"http://{host}:{port}"
+    coco_sdk.COCOHUB_URL = url
+    http_pool = HttpPool(base_url=url)
+
+    cases = [
+        ("exchange new client", lambda i: coco_sdk.exchange("comp", "s1", f"hi {i}")),
+        ("exchange http_pool", lambda i: http_pool.exchange("comp", "s1", f"hi {i}")),
+        ("query_intents new client", lambda i: coco_sdk.query_intents(["yes"], "yes")),
+        ("query_intents http_pool", lambda i: http_pool.query_intents(["yes"], "yes")),
+    ]
+    print(f"handshake {handshake_ms}ms, {calls} sequential calls")
+    print(f"{'':>26} {'mean ms':>9} {'p95 ms':>9}")
+    for name, call in cases:
+        mean, p95 = await measure(call, calls)
+        print(f"{name:>26} {mean * 1000:>9.2f} {p95 * 1000:>9.2f}")
+    print(http_pool.stats())
+
+    await http_pool.aclose()
+    server.close()
+    await server.wait_closed()
+
+
+def run(calls=500, handshake_ms=5.0):
+    asyncio.run(main(int(calls), float(handshake_ms)))
+
+
+if __name__ == "__main__":
+    run(*sys.argv[1:])
@@ -0,0 +1,69 @@
+"""
+    Per turn completion cost over many turns of one session
+
+    Compares BotSessionContainer.exchange_turn (one future per turn)
+    with waiting on bot_listen / bot_task / wait_for_out_of_context wrapped in tasks
+    with asyncio.wait, where the losing waiter tasks are left pending every turn.
+
+    python -m benchmarks.turn_completion [turns]
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from agt.server import BotSessionContainer
+
+
+async def echo_bot(state):
+    while True:
+        user_input = await state.user_input()
+        await state.say(user_input)
+
+
+async def exchange_turn(sc: BotSessionContainer, user_input: str):
+    await sc.exchange_turn(user_input)
+
+
+async def asyncio_wait_turn(sc: BotSessionContainer, user_input: str):
+    await sc.user_turn(user_input)
+    await asyncio.wait(
+        [
+            asyncio.ensure_future(sc.conv_state.bot_listen()),
+            sc.bot_task,
+            asyncio.ensure_future(sc.wait_for_out_of_context()),
+        ],
+        return_when=asyncio.FIRST_COMPLETED,
+    )
+
+
+async def run_turns(turn, turns: int, report_every: int):
+    sc = BotSessionContainer(echo_bot)
+    # keep the log from growing so the measurement is about turn completion
+    sc.conv_state.log.retention = 2
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    print(f"{'turns':>8} {'tasks':>8} {'traced KiB':>12}")
+    for i in range(1, turns + 1):
+        await turn(sc, "hello")
+        sc.clear_responses()
+        if i % report_every == 0:
+            current, _ = tracemalloc.get_traced_memory()
+            print(f"{i:>8} {len(asyncio.all_tasks()):>8} {current / 1024:>12.1f}")
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    sc.bot_task.cancel()
+    print(f"{turns / elapsed:.0f} turns/s (traced)")
+
+
+def run(turns=100_000):
+    report_every = max(turns // 10, 1)
+    for name, turn in [("exchange_turn", exchange_turn), ("asyncio.wait", asyncio_wait_turn)]:
+        print(name)
+        asyncio.run(run_turns(turn, turns, report_every))
+        print()
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:]])
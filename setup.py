@@ -40,6 +40,7 @@ setup(
         "telegram": ["aiogram"],
         "dsl": ["hy"],
         "vendor": ["sanic", "python-dotenv"],
+        "msgpack": ["msgpack"],
     },
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",